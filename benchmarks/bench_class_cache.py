@@ -0,0 +1,88 @@
+"""
+Benchmark the class read path and QR scans against a large class document.
+
+Builds an 80-student class with 168 days of attendance in a temporary file-backend
+directory and times get_class with the in-process cache on and off, and scan_qr_code.
+
+    python benchmarks/bench_class_cache.py [--students 80] [--days 168] [--repeat 50]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import DatabaseManager  # noqa: E402
+
+
+def build_class(students: int, days: int) -> dict:
+    start = date(2026, 1, 1)
+    dates = [(start + timedelta(days=d)).isoformat() for d in range(days)]
+    session_day = {
+        "sessions": [
+            {"id": "session_1", "name": "QR Session 1", "status": "P"},
+            {"id": "session_2", "name": "QR Session 2", "status": "A"},
+        ],
+        "updated_at": "2026-01-01T00:00:00",
+    }
+    return {
+        "teacher_id": "t1",
+        "name": "Benchmark class",
+        "enrollment_mode": "enrollment_via_id",
+        "students": [
+            {
+                "id": i,
+                "name": f"Student {i}",
+                "attendance": {d: (dict(session_day) if n % 3 == 0 else "P") for n, d in enumerate(dates)},
+            }
+            for i in range(students)
+        ],
+    }
+
+
+def timed(fn, repeat: int) -> float:
+    """Mean milliseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=80)
+    parser.add_argument("--days", type=int, default=168)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix="lernova-bench-")
+    cached = DatabaseManager("file", base_dir=base_dir)
+    uncached = DatabaseManager("file", base_dir=base_dir, cache_ttl=0)
+
+    cached.create_user("t1", {"email": "bench@example.com"})
+    cached.create_class("t1", "c1", build_class(args.students, args.days))
+    for i in range(args.students):
+        cached.create_enrollment({"class_id": "c1", "student_id": f"s{i}", "student_record_id": i, "status": "active"})
+
+    cached.get_class("c1")
+    print(f"get_class, cache hit:       {timed(lambda: cached.get_class('c1'), args.repeat):8.2f} ms")
+    print(f"get_class, backend read:    {timed(lambda: uncached.get_class('c1'), args.repeat):8.2f} ms")
+
+    today = "2026-12-31"
+    cached.start_qr_session("c1", "t1", today, rotation_interval=3600)
+    code = cached.get_active_qr_session("c1", today)["current_code"]
+    scanners = iter(range(args.students))
+    repeat = min(args.repeat, args.students)
+    print(f"scan_qr_code, first scan:   {timed(lambda: cached.scan_qr_code(f's{next(scanners)}', 'c1', code, today), repeat):8.2f} ms")
+    print(f"scan_qr_code, repeat scan:  {timed(lambda: cached.scan_qr_code('s0', 'c1', code, today), args.repeat):8.2f} ms")
+
+    cached.close()
+    uncached.close()
+
+
+if __name__ == "__main__":
+    main()
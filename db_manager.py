@@ -1,14 +1,198 @@
 """
 Dynamic Database Manager - Supports Multiple Database Backends
-Supports: File-based storage, MongoDB, and extensible to other databases
+Supports: File-based storage, SQLite, MongoDB, and extensible to other databases
 """
 
 import json
+import logging
 import os
-from typing import Optional, Dict, Any, List
+import atexit
+import inspect
+import pickle
+import copy
+import queue
+import random
+import string
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, Iterable, Iterator
 from datetime import datetime
 from abc import ABC, abstractmethod
 import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _dumps_json(data: Any) -> bytes:
+    """Serialize to indented UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def _loads_json(raw: bytes) -> Any:
+    """Parse UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+_now_iso_state: Tuple[str, float] = ("", 0.0)
+
+
+def _now_iso() -> str:
+    """Current UTC time as ISO string, reused for up to 0.5s between calls"""
+    global _now_iso_state
+    stamp, taken_at = _now_iso_state
+    now = time.monotonic()
+    if not stamp or now - taken_at > 0.5:
+        stamp = datetime.utcnow().isoformat()
+        _now_iso_state = (stamp, now)
+    return stamp
+
+
+def _split_update(updates: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Turn a partial update into MongoDB update operators.
+    Plain keys become $set; "$inc"/"$push" (and other operator) sections pass through.
+    """
+    ops: Dict[str, Dict[str, Any]] = {}
+    for key, value in updates.items():
+        if key.startswith('$'):
+            ops.setdefault(key, {}).update(value)
+        else:
+            ops.setdefault('$set', {})[key] = value
+    return ops
+
+
+def _apply_update(doc: Dict[str, Any], updates: Dict[str, Any]) -> None:
+    """Apply a partial update ($set / $inc / $push on top-level fields) to a document in place"""
+    for op, fields in _split_update(updates).items():
+        if op == '$set':
+            doc.update(fields)
+        elif op == '$inc':
+            for key, amount in fields.items():
+                doc[key] = doc.get(key, 0) + amount
+        elif op == '$push':
+            for key, value in fields.items():
+                doc.setdefault(key, []).append(value)
+        else:
+            raise ValueError(f"Unsupported update operator: {op}")
+
+
+def _apply_attendance_marks(class_data: Dict[str, Any], marks: Iterable[Tuple[Any, str, Any]]) -> None:
+    """Write (student_record_id, date, value) marks into the students of a class document"""
+    by_id = {s.get('id'): s for s in class_data.get('students', [])}
+    for student_record_id, date, value in marks:
+        student = by_id.get(student_record_id)
+        if student is not None:
+            student.setdefault('attendance', {})[date] = value
+
+
+def _escape_format(text: str) -> str:
+    """Escape text for use as a literal part of a str.format template"""
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _is_field_name_safe(name: str) -> bool:
+    """Whether name can be used as one segment of a MongoDB update path"""
+    return bool(name) and '.' not in name and not name.startswith('$')
+
+
+# Enrollment / QR session status and attendance marks used on the scan and stop paths
+_STATUS_ACTIVE = "active"
+_MARK_P = "P"
+_MARK_A = "A"
+
+# Per-day QR session ids and names, indexed by session number
+_SESSION_IDS = [f"session_{i}" for i in range(64)]
+_SESSION_NAMES = [f"QR Session {i}" for i in range(64)]
+
+# QR codes are unguessable 8-char tokens drawn from the OS CSPRNG
+_QR_ALPHABET = string.ascii_uppercase + string.digits
+_QR_RAND = random.SystemRandom()
+
+# mkstemp creates files as 0600; atomic writes restore the mode open() would have used
+_default_file_mode: Optional[int] = None
+
+
+def _new_file_mode() -> int:
+    """Mode open() gives a new file (0666 minus the umask), read on first use"""
+    global _default_file_mode
+    if _default_file_mode is None:
+        umask = None
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('Umask:'):
+                        umask = int(line.split()[1], 8)
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+        if umask is None:
+            # Without procfs the umask can only be read by setting it; 022 is the usual value,
+            # so a file created by another thread in between most likely gets its normal mode
+            umask = os.umask(0o022)
+            os.umask(umask)
+        _default_file_mode = 0o666 & ~umask
+    return _default_file_mode
+
+
+def _project(doc: Optional[Dict[str, Any]], fields: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """Keep only the requested top-level fields of a document (all of them if fields is None)"""
+    if doc is None or fields is None:
+        return doc
+    return {f: doc[f] for f in fields if f in doc}
+
+
+class _TTLCache:
+    """Small thread-safe in-process LRU cache whose entries expire after ttl seconds"""
+    
+    _MISSING = object()
+    
+    def __init__(self, maxsize: int = 4096, ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Tuple, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Tuple) -> Any:
+        """Return the cached value or _TTLCache._MISSING"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return self._MISSING
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return self._MISSING
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: Tuple, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def invalidate(self, key: Tuple) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
 
 
 class DatabaseBackend(ABC):
@@ -20,7 +204,7 @@ class DatabaseBackend(ABC):
         pass
     
     @abstractmethod
-    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
         pass
     
@@ -45,7 +229,7 @@ class DatabaseBackend(ABC):
         pass
     
     @abstractmethod
-    def get_class(self, class_id: str) -> Optional[Dict[str, Any]]:
+    def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """Get class by ID"""
         pass
     
@@ -60,7 +244,7 @@ class DatabaseBackend(ABC):
         pass
     
     @abstractmethod
-    def get_all_classes(self, teacher_id: str) -> List[Dict[str, Any]]:
+    def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all classes for a teacher"""
         pass
     
@@ -85,20 +269,40 @@ class DatabaseBackend(ABC):
         pass
     
     @abstractmethod
-    def get_enrollments(self, class_id: str) -> List[Dict[str, Any]]:
+    def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        """Create many enrollment records in one write"""
+        pass
+    
+    @abstractmethod
+    def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all enrollments for a class"""
         pass
     
     @abstractmethod
-    def update_enrollment(self, class_id: str, student_id: str, enrollment_data: Dict[str, Any]) -> None:
-        """Update enrollment status"""
+    def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        """
+        Update enrollment, creating it if it doesn't exist
+        updates holds only the changed fields; "$inc" / "$push" sections are also accepted
+        """
         pass
     
+    def get_active_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get the active enrollments for a class (backends that can filter in the query override this)"""
+        enrollments = [e for e in self.get_enrollments(class_id) if e.get('status') == _STATUS_ACTIVE]
+        if fields is None:
+            return enrollments
+        return [_project(e, fields) for e in enrollments]
+    
     @abstractmethod
     def save_contact_message(self, message_data: Dict[str, Any]) -> None:
         """Save contact form message"""
         pass
     
+    @abstractmethod
+    def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """Save many contact form messages in one write"""
+        pass
+    
     @abstractmethod
     def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get contact messages"""
@@ -118,20 +322,99 @@ class DatabaseBackend(ABC):
     def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
         """Update QR session"""
         pass
+    
+    def update_qr_code(self, class_id: str, date: str, current_code: str, code_generated_at: str) -> bool:
+        """
+        Persist a rotated QR code, only if the stored session is still active
+        Returns False when the session is missing or no longer active
+        """
+        stored = self.get_qr_session(class_id, date)
+        if not stored or stored.get('status') != _STATUS_ACTIVE:
+            return False
+        stored['current_code'] = current_code
+        stored['code_generated_at'] = code_generated_at
+        self.update_qr_session(class_id, date, stored)
+        return True
+    
+    def update_attendance(self, class_id: str, marks: List[Tuple[Any, str, Any]]) -> None:
+        """
+        Set students[id].attendance[date] for each (student_record_id, date, value)
+        The default re-reads the class, applies the marks and writes it back; backends that
+        can write single marks override this
+        """
+        class_data = self.get_class(class_id)
+        if class_data is None:
+            return
+        _apply_attendance_marks(class_data, marks)
+        self.update_class(class_id, class_data)
+    
+    def batch_update(self, ops: List[Tuple[str, Tuple, Any]]) -> None:
+        """
+        Apply several updates together; ops are ("class", (class_id,), data),
+        ("attendance", (class_id,), [(student_record_id, date, value), ...]) or
+        ("qr_session", (class_id, date), data). Backends that can commit them
+        atomically override this, the default applies them one by one
+        """
+        for kind, key, data in ops:
+            if kind == "class":
+                self.update_class(*key, data)
+            elif kind == "attendance":
+                self.update_attendance(*key, data)
+            elif kind == "qr_session":
+                self.update_qr_session(*key, data)
+            else:
+                raise ValueError(f"Unsupported batch update: {kind}")
+    
+    # Streaming reads - backends with server-side cursors override these
+    def iter_all_classes(self, teacher_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Iterate over all classes for a teacher"""
+        yield from self.get_all_classes(teacher_id)
+    
+    def iter_enrollments(self, class_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Iterate over all enrollments for a class"""
+        yield from self.get_enrollments(class_id)
+    
+    def iter_contact_messages(self, email: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Iterate over contact messages"""
+        yield from self.get_contact_messages(email)
 
 
 class MongoDBBackend(DatabaseBackend):
     """MongoDB implementation of database backend"""
     
-    def __init__(self, connection_string: str, database_name: str = "lernova_db"):
-        """Initialize MongoDB connection"""
+    # Cleared after the first failure on a standalone server (transactions need a replica set)
+    _transactions_supported = True
+    # (collection, keys) of unique compound indexes that older deployments have as non-unique;
+    # scripts/migrate_unique_indexes.py removes duplicates and upgrades them
+    UNIQUE_COMPOUND_INDEXES = (
+        ("enrollments", [("class_id", 1), ("student_id", 1)]),
+        ("qr_sessions", [("class_id", 1), ("date", 1)]),
+    )
+    
+    def __init__(self, connection_string: str, database_name: str = "lernova_db",
+                 max_pool_size: int = 200, min_pool_size: int = 10,
+                 max_idle_time_ms: int = 300_000, socket_timeout_ms: int = 30_000,
+                 server_selection_timeout_ms: int = 5_000,
+                 compressors: str = "zstd,zlib", zlib_compression_level: int = 6):
+        """Initialize MongoDB connection with an explicitly sized connection pool"""
         try:
-            from pymongo import MongoClient
+            from pymongo import MongoClient, ReadPreference
             from pymongo.errors import ConnectionFailure
         except ImportError:
             raise ImportError("pymongo is required for MongoDB backend. Install with: pip install pymongo")
         
-        self.client = MongoClient(connection_string)
+        self.client = MongoClient(
+            connection_string,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            maxIdleTimeMS=max_idle_time_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            retryWrites=True,
+            # Negotiated per connection; compressors the server or driver lacks are skipped
+            compressors=compressors,
+            zlibCompressionLevel=zlib_compression_level,
+        )
         self.db = self.client[database_name]
         
         # Test connection
@@ -149,9 +432,23 @@ class MongoDBBackend(DatabaseBackend):
         self.contact_messages = self.db['contact_messages']
         self.qr_sessions = self.db['qr_sessions']
         
+        # Read-only handles for heavy listings; served by secondaries when a replica set has them
+        self.classes_ro = self.db.get_collection('classes', read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.enrollments_ro = self.db.get_collection('enrollments', read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.contact_messages_ro = self.db.get_collection(
+            'contact_messages', read_preference=ReadPreference.SECONDARY_PREFERRED
+        )
+        
         # Create indexes
         self._create_indexes()
     
+    @staticmethod
+    def _projection(fields: Optional[List[str]]) -> Dict[str, int]:
+        """Build a find() projection; None keeps every field except _id"""
+        projection = {f: 1 for f in fields} if fields else {}
+        projection["_id"] = 0
+        return projection
+    
     def _create_indexes(self):
         """Create database indexes for better performance"""
         # Users
@@ -166,28 +463,52 @@ class MongoDBBackend(DatabaseBackend):
         self.students.create_index("student_id", unique=True)
         self.students.create_index("email")
         
-        # Enrollments
-        self.enrollments.create_index([("class_id", 1), ("student_id", 1)])
+        # Enrollments / QR Sessions (older deployments have non-unique versions of these)
+        for collection_name, keys in self.UNIQUE_COMPOUND_INDEXES:
+            self._ensure_unique_index(self.db[collection_name], keys)
         
-        # QR Sessions
-        self.qr_sessions.create_index([("class_id", 1), ("date", 1)])
+        # Contact messages
+        self.contact_messages.create_index([("email", 1), ("created_at", -1)])
         
         print("✅ MongoDB indexes created")
     
+    @staticmethod
+    def _ensure_unique_index(collection, keys: List[Tuple[str, int]]) -> None:
+        """
+        Create a unique compound index. Never changes data and never raises: when a non-unique
+        index on the same fields exists, or duplicates block the unique one, it logs and skips
+        (the code still works, just without the guarantee) - run
+        scripts/migrate_unique_indexes.py to de-duplicate and upgrade the index
+        """
+        from pymongo.errors import OperationFailure
+        
+        fields = [field for field, _ in keys]
+        try:
+            for info in collection.index_information().values():
+                if [field for field, _ in info.get('key', [])] == fields and not info.get('unique'):
+                    logger.warning(
+                        "Non-unique index %s on %s left in place; run scripts/migrate_unique_indexes.py",
+                        fields, collection.name
+                    )
+                    return
+            collection.create_index(keys, unique=True)
+        except OperationFailure as e:
+            logger.warning("Could not create unique index %s on %s: %s", fields, collection.name, e)
+    
     def create_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
         """Create a new user"""
         user_data['user_id'] = user_id
-        user_data['created_at'] = datetime.utcnow().isoformat()
+        user_data['created_at'] = _now_iso()
         self.users.insert_one(user_data)
     
-    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
-        user = self.users.find_one({"user_id": user_id}, {"_id": 0})
+        user = self.users.find_one({"user_id": user_id}, self._projection(fields))
         return user
     
     def update_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
         """Update user data"""
-        user_data['updated_at'] = datetime.utcnow().isoformat()
+        user_data['updated_at'] = _now_iso()
         self.users.update_one(
             {"user_id": user_id},
             {"$set": user_data}
@@ -206,35 +527,81 @@ class MongoDBBackend(DatabaseBackend):
         """Create a new class"""
         class_data['class_id'] = class_id
         class_data['teacher_id'] = teacher_id
-        class_data['created_at'] = datetime.utcnow().isoformat()
+        class_data['created_at'] = _now_iso()
         self.classes.insert_one(class_data)
     
-    def get_class(self, class_id: str) -> Optional[Dict[str, Any]]:
+    def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """Get class by ID"""
-        cls = self.classes.find_one({"class_id": class_id}, {"_id": 0})
+        cls = self.classes.find_one({"class_id": class_id}, self._projection(fields))
         return cls
     
     def update_class(self, class_id: str, class_data: Dict[str, Any]) -> None:
         """Update class data"""
-        class_data['updated_at'] = datetime.utcnow().isoformat()
+        class_data['updated_at'] = _now_iso()
         self.classes.update_one(
             {"class_id": class_id},
             {"$set": class_data}
         )
     
+    def update_attendance(self, class_id: str, marks: List[Tuple[Any, str, Any]]) -> None:
+        """Set attendance marks in a single $set, addressing students by id through array filters"""
+        self._write_attendance(class_id, marks)
+    
+    def _write_attendance(self, class_id: str, marks: List[Tuple[Any, str, Any]], session=None) -> None:
+        """
+        One update_one for attendance marks. A date that can't be used as a field name
+        (contains '.' or starts with '$') can't be addressed by path, so then the marks are
+        applied to the roster read in the same session and the students array is $set whole
+        """
+        if all(_is_field_name_safe(date) for _, date, _ in marks):
+            update, array_filters = self._attendance_update(marks)
+            self.classes.update_one(
+                {"class_id": class_id}, {"$set": update}, array_filters=array_filters, session=session
+            )
+            return
+        class_data = self.classes.find_one({"class_id": class_id}, {"students": 1, "_id": 0}, session=session)
+        if class_data is None:
+            return
+        _apply_attendance_marks(class_data, marks)
+        self.classes.update_one(
+            {"class_id": class_id},
+            {"$set": {"students": class_data.get("students", []), "updated_at": _now_iso()}},
+            session=session
+        )
+    
+    @staticmethod
+    def _attendance_update(marks: List[Tuple[Any, str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        $set document and array filters for attendance marks - students are matched by id,
+        never by array position, so a roster change since the class was read cannot misdirect a mark
+        """
+        update: Dict[str, Any] = {}
+        array_filters: List[Dict[str, Any]] = []
+        names: Dict[Any, str] = {}
+        for student_record_id, date, value in marks:
+            if not _is_field_name_safe(date):
+                raise ValueError(f"Attendance date cannot be used as a field name: {date!r}")
+            name = names.get(student_record_id)
+            if name is None:
+                name = names[student_record_id] = f"s{len(names)}"
+                array_filters.append({f"{name}.id": student_record_id})
+            update[f"students.$[{name}].attendance.{date}"] = value
+        update['updated_at'] = _now_iso()
+        return update, array_filters
+    
     def delete_class(self, class_id: str) -> None:
         """Delete class"""
         self.classes.delete_one({"class_id": class_id})
     
-    def get_all_classes(self, teacher_id: str) -> List[Dict[str, Any]]:
+    def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all classes for a teacher"""
-        classes = list(self.classes.find({"teacher_id": teacher_id}, {"_id": 0}))
+        classes = list(self.classes_ro.find({"teacher_id": teacher_id}, self._projection(fields)))
         return classes
     
     def create_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
         """Create a new student"""
         student_data['student_id'] = student_id
-        student_data['created_at'] = datetime.utcnow().isoformat()
+        student_data['created_at'] = _now_iso()
         self.students.insert_one(student_data)
     
     def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
@@ -244,7 +611,7 @@ class MongoDBBackend(DatabaseBackend):
     
     def update_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
         """Update student data"""
-        student_data['updated_at'] = datetime.utcnow().isoformat()
+        student_data['updated_at'] = _now_iso()
         self.students.update_one(
             {"student_id": student_id},
             {"$set": student_data}
@@ -252,38 +619,74 @@ class MongoDBBackend(DatabaseBackend):
     
     def create_enrollment(self, enrollment_data: Dict[str, Any]) -> None:
         """Create enrollment record"""
-        enrollment_data['created_at'] = datetime.utcnow().isoformat()
+        enrollment_data['created_at'] = _now_iso()
         self.enrollments.insert_one(enrollment_data)
     
-    def get_enrollments(self, class_id: str) -> List[Dict[str, Any]]:
+    def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        """Create many enrollment records with a single bulk_write"""
+        if not enrollments:
+            return
+        from pymongo import InsertOne
+        created_at = _now_iso()
+        ops = []
+        for enrollment_data in enrollments:
+            enrollment_data['created_at'] = created_at
+            ops.append(InsertOne(enrollment_data))
+        self.enrollments.bulk_write(ops, ordered=False)
+    
+    def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all enrollments for a class"""
-        enrollments = list(self.enrollments.find({"class_id": class_id}, {"_id": 0}))
+        enrollments = list(self.enrollments.find({"class_id": class_id}, self._projection(fields)))
         return enrollments
     
-    def update_enrollment(self, class_id: str, student_id: str, enrollment_data: Dict[str, Any]) -> None:
-        """Update enrollment status"""
-        enrollment_data['updated_at'] = datetime.utcnow().isoformat()
+    def get_active_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get the active enrollments for a class"""
+        return list(self.enrollments.find({"class_id": class_id, "status": _STATUS_ACTIVE}, self._projection(fields)))
+    
+    def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        """Update only the given enrollment fields, creating the enrollment if it doesn't exist"""
+        ops = _split_update(updates)
+        ops.setdefault('$set', {})['updated_at'] = _now_iso()
         self.enrollments.update_one(
             {"class_id": class_id, "student_id": student_id},
-            {"$set": enrollment_data}
+            ops,
+            upsert=True
         )
     
     def save_contact_message(self, message_data: Dict[str, Any]) -> None:
         """Save contact form message"""
-        message_data['created_at'] = datetime.utcnow().isoformat()
+        message_data['created_at'] = _now_iso()
         self.contact_messages.insert_one(message_data)
     
+    def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """Save many contact form messages with a single bulk_write"""
+        if not messages:
+            return
+        from pymongo import InsertOne
+        created_at = _now_iso()
+        ops = []
+        for message_data in messages:
+            message_data['created_at'] = created_at
+            ops.append(InsertOne(message_data))
+        self.contact_messages.bulk_write(ops, ordered=False)
+    
     def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get contact messages"""
+        """Get contact messages, newest first"""
         query = {"email": email} if email else {}
-        messages = list(self.contact_messages.find(query, {"_id": 0}))
+        cursor = self.contact_messages_ro.find(query, {"_id": 0}).sort([("created_at", -1), ("_id", -1)])
+        messages = list(cursor)
         return messages
     
     def create_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
         """Create QR session"""
         session_data['class_id'] = class_id
         session_data['date'] = date
-        self.qr_sessions.insert_one(session_data)
+        # One session document per class/date: a new session replaces the previous one
+        self.qr_sessions.replace_one(
+            {"class_id": class_id, "date": date},
+            session_data,
+            upsert=True
+        )
     
     def get_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
         """Get QR session"""
@@ -295,12 +698,310 @@ class MongoDBBackend(DatabaseBackend):
     
     def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
         """Update QR session"""
-        session_data['updated_at'] = datetime.utcnow().isoformat()
+        session_data['updated_at'] = _now_iso()
         self.qr_sessions.update_one(
             {"class_id": class_id, "date": date},
             {"$set": session_data},
             upsert=True
         )
+    
+    def update_qr_code(self, class_id: str, date: str, current_code: str, code_generated_at: str) -> bool:
+        """Persist a rotated QR code, only if the stored session is still active"""
+        result = self.qr_sessions.update_one(
+            {"class_id": class_id, "date": date, "status": _STATUS_ACTIVE},
+            {"$set": {"current_code": current_code, "code_generated_at": code_generated_at,
+                      "updated_at": _now_iso()}}
+        )
+        return result.matched_count > 0
+    
+    def batch_update(self, ops: List[Tuple[str, Tuple, Any]]) -> None:
+        """Apply class / QR session updates in one transaction (one by one on a standalone server)"""
+        from pymongo.errors import OperationFailure
+        
+        if self._transactions_supported:
+            try:
+                with self.client.start_session() as session:
+                    session.with_transaction(lambda s: self._apply_batch(ops, s))
+                return
+            except OperationFailure as e:
+                if e.code != 20:  # IllegalOperation: transactions not supported here
+                    raise
+                self._transactions_supported = False
+        self._apply_batch(ops)
+    
+    def _apply_batch(self, ops: List[Tuple[str, Tuple, Any]], session=None) -> None:
+        now = _now_iso()
+        for kind, key, data in ops:
+            if kind == "attendance":
+                self._write_attendance(key[0], data, session)
+                continue
+            data['updated_at'] = now
+            if kind == "class":
+                self.classes.update_one({"class_id": key[0]}, {"$set": data}, session=session)
+            elif kind == "qr_session":
+                self.qr_sessions.update_one(
+                    {"class_id": key[0], "date": key[1]}, {"$set": data}, upsert=True, session=session
+                )
+            else:
+                raise ValueError(f"Unsupported batch update: {kind}")
+    
+    def iter_all_classes(self, teacher_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream classes for a teacher from the server cursor"""
+        yield from self.classes_ro.find({"teacher_id": teacher_id}, {"_id": 0}).batch_size(batch_size)
+    
+    def iter_enrollments(self, class_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream enrollments for a class from the server cursor"""
+        yield from self.enrollments_ro.find({"class_id": class_id}, {"_id": 0}).batch_size(batch_size)
+    
+    def iter_contact_messages(self, email: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream contact messages from the server cursor"""
+        query = {"email": email} if email else {}
+        cursor = self.contact_messages_ro.find(query, {"_id": 0}).sort([("created_at", -1), ("_id", -1)])
+        yield from cursor.batch_size(batch_size)
+
+
+class AsyncMongoDBBackend:
+    """
+    Asynchronous MongoDB backend built on Motor
+    
+    Mirrors the MongoDBBackend CRUD methods as coroutines so async FastAPI
+    route handlers can await them without blocking the event loop.
+    Indexes are created by the synchronous MongoDBBackend.
+    """
+    
+    def __init__(self, connection_string: str, database_name: str = "lernova_db",
+                 max_pool_size: int = 200, min_pool_size: int = 10,
+                 max_idle_time_ms: int = 300_000, socket_timeout_ms: int = 30_000,
+                 server_selection_timeout_ms: int = 5_000,
+                 compressors: str = "zstd,zlib", zlib_compression_level: int = 6):
+        """Initialize Motor client (connects lazily on first operation)"""
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            from pymongo import ReadPreference
+        except ImportError:
+            raise ImportError("motor is required for async MongoDB backend. Install with: pip install motor")
+        
+        self.client = AsyncIOMotorClient(
+            connection_string,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            maxIdleTimeMS=max_idle_time_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            retryWrites=True,
+            # Negotiated per connection; compressors the server or driver lacks are skipped
+            compressors=compressors,
+            zlibCompressionLevel=zlib_compression_level,
+        )
+        self.db = self.client[database_name]
+        
+        # Collections
+        self.users = self.db['users']
+        self.classes = self.db['classes']
+        self.students = self.db['students']
+        self.enrollments = self.db['enrollments']
+        self.contact_messages = self.db['contact_messages']
+        self.qr_sessions = self.db['qr_sessions']
+        
+        # Read-only handles for heavy listings; served by secondaries when a replica set has them
+        self.classes_ro = self.db.get_collection('classes', read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.contact_messages_ro = self.db.get_collection(
+            'contact_messages', read_preference=ReadPreference.SECONDARY_PREFERRED
+        )
+    
+    _projection = staticmethod(MongoDBBackend._projection)
+    
+    async def create_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
+        """Create a new user"""
+        user_data['user_id'] = user_id
+        user_data['created_at'] = _now_iso()
+        await self.users.insert_one(user_data)
+    
+    async def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        return await self.users.find_one({"user_id": user_id}, self._projection(fields))
+    
+    async def update_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
+        """Update user data"""
+        user_data['updated_at'] = _now_iso()
+        await self.users.update_one({"user_id": user_id}, {"$set": user_data})
+    
+    async def delete_user(self, user_id: str) -> None:
+        """Delete user"""
+        await self.users.delete_one({"user_id": user_id})
+    
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get user by email"""
+        return await self.users.find_one({"email": email}, {"_id": 0})
+    
+    async def create_class(self, teacher_id: str, class_id: str, class_data: Dict[str, Any]) -> None:
+        """Create a new class"""
+        class_data['class_id'] = class_id
+        class_data['teacher_id'] = teacher_id
+        class_data['created_at'] = _now_iso()
+        await self.classes.insert_one(class_data)
+    
+    async def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get class by ID"""
+        return await self.classes.find_one({"class_id": class_id}, self._projection(fields))
+    
+    async def update_class(self, class_id: str, class_data: Dict[str, Any]) -> None:
+        """Update class data"""
+        class_data['updated_at'] = _now_iso()
+        await self.classes.update_one({"class_id": class_id}, {"$set": class_data})
+    
+    async def delete_class(self, class_id: str) -> None:
+        """Delete class"""
+        await self.classes.delete_one({"class_id": class_id})
+    
+    async def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get all classes for a teacher"""
+        cursor = self.classes_ro.find({"teacher_id": teacher_id}, self._projection(fields))
+        return await cursor.to_list(length=None)
+    
+    async def create_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
+        """Create a new student"""
+        student_data['student_id'] = student_id
+        student_data['created_at'] = _now_iso()
+        await self.students.insert_one(student_data)
+    
+    async def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """Get student by ID"""
+        return await self.students.find_one({"student_id": student_id}, {"_id": 0})
+    
+    async def update_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
+        """Update student data"""
+        student_data['updated_at'] = _now_iso()
+        await self.students.update_one({"student_id": student_id}, {"$set": student_data})
+    
+    async def create_enrollment(self, enrollment_data: Dict[str, Any]) -> None:
+        """Create enrollment record"""
+        enrollment_data['created_at'] = _now_iso()
+        await self.enrollments.insert_one(enrollment_data)
+    
+    async def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        """Create many enrollment records with a single bulk_write"""
+        if not enrollments:
+            return
+        from pymongo import InsertOne
+        created_at = _now_iso()
+        ops = []
+        for enrollment_data in enrollments:
+            enrollment_data['created_at'] = created_at
+            ops.append(InsertOne(enrollment_data))
+        await self.enrollments.bulk_write(ops, ordered=False)
+    
+    async def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get all enrollments for a class"""
+        cursor = self.enrollments.find({"class_id": class_id}, self._projection(fields))
+        return await cursor.to_list(length=None)
+    
+    async def get_active_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get the active enrollments for a class"""
+        cursor = self.enrollments.find({"class_id": class_id, "status": _STATUS_ACTIVE}, self._projection(fields))
+        return await cursor.to_list(length=None)
+    
+    async def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        """Update only the given enrollment fields, creating the enrollment if it doesn't exist"""
+        ops = _split_update(updates)
+        ops.setdefault('$set', {})['updated_at'] = _now_iso()
+        await self.enrollments.update_one(
+            {"class_id": class_id, "student_id": student_id},
+            ops,
+            upsert=True
+        )
+    
+    async def save_contact_message(self, message_data: Dict[str, Any]) -> None:
+        """Save contact form message"""
+        message_data['created_at'] = _now_iso()
+        await self.contact_messages.insert_one(message_data)
+    
+    async def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """Save many contact form messages with a single bulk_write"""
+        if not messages:
+            return
+        from pymongo import InsertOne
+        created_at = _now_iso()
+        ops = []
+        for message_data in messages:
+            message_data['created_at'] = created_at
+            ops.append(InsertOne(message_data))
+        await self.contact_messages.bulk_write(ops, ordered=False)
+    
+    async def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get contact messages, newest first"""
+        query = {"email": email} if email else {}
+        cursor = self.contact_messages_ro.find(query, {"_id": 0}).sort([("created_at", -1), ("_id", -1)])
+        return await cursor.to_list(length=None)
+    
+    async def create_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
+        """Create QR session"""
+        session_data['class_id'] = class_id
+        session_data['date'] = date
+        await self.qr_sessions.replace_one(
+            {"class_id": class_id, "date": date},
+            session_data,
+            upsert=True
+        )
+    
+    async def get_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """Get QR session"""
+        return await self.qr_sessions.find_one({"class_id": class_id, "date": date}, {"_id": 0})
+    
+    async def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
+        """Update QR session"""
+        session_data['updated_at'] = _now_iso()
+        await self.qr_sessions.update_one(
+            {"class_id": class_id, "date": date},
+            {"$set": session_data},
+            upsert=True
+        )
+
+
+class _AsyncManagedBackend:
+    """
+    The Motor backend as exposed on DatabaseManager.aio. Reads pass straight through;
+    writes additionally drop what the manager holds for the written document (cache
+    entries, enrollment index, in-memory QR session) so the sync API never serves
+    data an async handler has just changed in this process
+    """
+    
+    def __init__(self, backend: "AsyncMongoDBBackend", manager: "DatabaseManager"):
+        self._backend = backend
+        self._manager = manager
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self._backend, name)
+        if not name.startswith(("create_", "update_", "delete_", "bulk_create_")):
+            return attr
+        signature = inspect.signature(attr)
+        
+        async def write(*args, **kwargs):
+            result = await attr(*args, **kwargs)
+            self._invalidate(name, signature.bind(*args, **kwargs).arguments)
+            return result
+        
+        write.__name__ = name
+        write.__doc__ = attr.__doc__
+        return write
+    
+    def _invalidate(self, name: str, params: Dict[str, Any]) -> None:
+        manager = self._manager
+        if name.endswith("_user"):
+            manager._cache.invalidate(("user", params["user_id"]))
+        elif name.endswith("_class"):
+            manager._cache.invalidate(("class", params["class_id"]))
+        elif name.endswith("_student"):
+            manager._cache.invalidate(("student", params["student_id"]))
+        elif name == "create_enrollment":
+            manager._invalidate_enrollments(params["enrollment_data"].get("class_id"))
+        elif name == "bulk_create_enrollments":
+            for class_id in {e.get("class_id") for e in params["enrollments"]}:
+                manager._invalidate_enrollments(class_id)
+        elif name == "update_enrollment":
+            manager._invalidate_enrollments(params["class_id"])
+        elif name.endswith("_qr_session"):
+            manager._forget_qr_session((params["class_id"], params["date"]))
 
 
 class FileBackend(DatabaseBackend):
@@ -313,6 +1014,30 @@ class FileBackend(DatabaseBackend):
         self.contact_dir = os.path.join(base_dir, "contact")
         self.enrollments_dir = os.path.join(base_dir, "enrollments")
         self.qr_sessions_dir = os.path.join(base_dir, "qr_sessions")
+        self._email_index_path = os.path.join(self.users_dir, "_email_index.json")
+        self._email_index: Optional[Dict[str, str]] = None
+        self._email_index_stat: Optional[Tuple[int, int, int]] = None
+        self._class_index_path = os.path.join(base_dir, "_class_index.json")
+        self._class_index: Optional[Dict[str, str]] = None
+        self._class_index_stat: Optional[Tuple[int, int, int]] = None
+        self._contact_index_path = os.path.join(self.contact_dir, "_index.jsonl")
+        # Serialises building, appending to and reading the contact index
+        self._contact_lock = threading.Lock()
+        
+        # Path templates for the per-document files on the hot paths
+        # (directories are escaped, so a base_dir containing braces stays literal in str.format)
+        sep = os.sep
+        users_dir = _escape_format(self.users_dir)
+        students_dir = _escape_format(self.students_dir)
+        enrollments_dir = _escape_format(self.enrollments_dir)
+        qr_sessions_dir = _escape_format(self.qr_sessions_dir)
+        contact_dir = _escape_format(self.contact_dir)
+        self._user_fmt = f"{users_dir}{sep}{{}}{sep}user.json"
+        self._class_fmt = f"{users_dir}{sep}{{}}{sep}classes{sep}class_{{}}.json"
+        self._student_fmt = f"{students_dir}{sep}{{}}{sep}student.json"
+        self._enrollment_fmt = f"{enrollments_dir}{sep}class_{{}}_enrollments.json"
+        self._qr_session_fmt = f"{qr_sessions_dir}{sep}class_{{}}_{{}}.json"
+        self._contact_fmt = f"{contact_dir}{sep}{{}}"
         self._ensure_directories()
     
     def _ensure_directories(self):
@@ -326,108 +1051,238 @@ class FileBackend(DatabaseBackend):
     def _read_json(self, file_path: str) -> Optional[Dict[Any, Any]]:
         """Read JSON file safely"""
         try:
-            if not os.path.exists(file_path):
-                return None
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                return _loads_json(f.read())
+        except (FileNotFoundError, NotADirectoryError):
+            return None
         except Exception as e:
             print(f"Error reading {file_path}: {e}")
             return None
     
     def _write_json(self, file_path: str, data: Dict[Any, Any]):
-        """Write JSON file safely"""
+        """Write JSON file atomically (temp file in the same directory + os.replace)"""
+        tmp_path = None
         try:
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            directory = os.path.dirname(file_path)
+            os.makedirs(directory, exist_ok=True)
+            try:
+                mode = os.stat(file_path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = _new_file_mode()
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            if hasattr(os, 'fchmod'):
+                os.fchmod(fd, mode)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_dumps_json(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
         except Exception as e:
             print(f"Error writing {file_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
             raise
     
+    @staticmethod
+    def _file_stat(file_path: str) -> Optional[Tuple[int, int, int]]:
+        """Identifies a file version: atomic rewrites change the inode, in-place edits mtime/size"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def _load_email_index(self) -> Dict[str, str]:
+        """Load the email -> user_id index, rebuilding it from user files if missing"""
+        if self._email_index is None:
+            stat = self._file_stat(self._email_index_path)
+            index = self._read_json(self._email_index_path)
+            if index is None:
+                index = {}
+                for user_id in os.listdir(self.users_dir):
+                    user = self.get_user(user_id)
+                    if user and user.get('email'):
+                        index[user['email']] = user_id
+                self._email_index = index
+                self._save_email_index()
+            else:
+                self._email_index = index
+                self._email_index_stat = stat
+        return self._email_index
+    
+    def _reload_email_index_if_changed(self) -> bool:
+        """Re-read the email index if another process has rewritten it since we loaded it"""
+        if self._email_index is None or self._file_stat(self._email_index_path) == self._email_index_stat:
+            return False
+        self._email_index = None
+        self._load_email_index()
+        return True
+    
+    def _save_email_index(self):
+        """Persist the email index"""
+        self._write_json(self._email_index_path, self._email_index)
+        self._email_index_stat = self._file_stat(self._email_index_path)
+    
+    def _index_user_email(self, user_id: str, email: Optional[str]):
+        """Point the email index at user_id, dropping any previous email for that user"""
+        self._reload_email_index_if_changed()
+        index = self._load_email_index()
+        stale = [e for e, uid in index.items() if uid == user_id and e != email]
+        for e in stale:
+            del index[e]
+        changed = bool(stale)
+        if email and index.get(email) != user_id:
+            index[email] = user_id
+            changed = True
+        if changed:
+            self._save_email_index()
+    
+    def _load_class_index(self) -> Dict[str, str]:
+        """Load the class_id -> teacher_id index, rebuilding it from class files if missing"""
+        if self._class_index is None:
+            stat = self._file_stat(self._class_index_path)
+            index = self._read_json(self._class_index_path)
+            if index is None:
+                index = {}
+                for teacher_id in os.listdir(self.users_dir):
+                    classes_dir = os.path.join(self.users_dir, teacher_id, "classes")
+                    if not os.path.isdir(classes_dir):
+                        continue
+                    for filename in os.listdir(classes_dir):
+                        if filename.startswith("class_") and filename.endswith(".json"):
+                            index[filename[len("class_"):-len(".json")]] = teacher_id
+                self._class_index = index
+                self._save_class_index()
+            else:
+                self._class_index = index
+                self._class_index_stat = stat
+        return self._class_index
+    
+    def _reload_class_index_if_changed(self) -> bool:
+        """Re-read the class index if another process has rewritten it since we loaded it"""
+        if self._class_index is None or self._file_stat(self._class_index_path) == self._class_index_stat:
+            return False
+        self._class_index = None
+        self._load_class_index()
+        return True
+    
+    def _current_class_index(self) -> Dict[str, str]:
+        """The class index as it is on disk now - load this before changing and saving it"""
+        self._reload_class_index_if_changed()
+        return self._load_class_index()
+    
+    def _save_class_index(self):
+        """Persist the class index"""
+        self._write_json(self._class_index_path, self._class_index)
+        self._class_index_stat = self._file_stat(self._class_index_path)
+    
+    def _class_teacher(self, class_id: str) -> Optional[str]:
+        """
+        teacher_id owning class_id: from the index, re-read if another process changed it,
+        else from the class files (an entry lost to a concurrent index write is put back)
+        """
+        teacher_id = self._load_class_index().get(class_id)
+        if teacher_id:
+            return teacher_id
+        if self._reload_class_index_if_changed():
+            teacher_id = self._class_index.get(class_id)
+            if teacher_id:
+                return teacher_id
+        for teacher_id in os.listdir(self.users_dir):
+            if os.path.exists(self._class_fmt.format(teacher_id, class_id)):
+                self._class_index[class_id] = teacher_id
+                self._save_class_index()
+                return teacher_id
+        return None
+    
     def create_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
         """Create a new user"""
-        user_dir = os.path.join(self.users_dir, user_id)
-        os.makedirs(user_dir, exist_ok=True)
-        user_file = os.path.join(user_dir, "user.json")
-        user_data['created_at'] = datetime.utcnow().isoformat()
+        user_file = self._user_fmt.format(user_id)
+        user_data['created_at'] = _now_iso()
         self._write_json(user_file, user_data)
+        self._index_user_email(user_id, user_data.get('email'))
     
-    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+    def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
-        user_file = os.path.join(self.users_dir, user_id, "user.json")
-        return self._read_json(user_file)
+        user_file = self._user_fmt.format(user_id)
+        return _project(self._read_json(user_file), fields)
     
     def update_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
         """Update user data"""
-        user_file = os.path.join(self.users_dir, user_id, "user.json")
-        user_data['updated_at'] = datetime.utcnow().isoformat()
+        user_file = self._user_fmt.format(user_id)
+        user_data['updated_at'] = _now_iso()
         self._write_json(user_file, user_data)
+        self._index_user_email(user_id, user_data.get('email'))
     
     def delete_user(self, user_id: str) -> None:
         """Delete user"""
         user_dir = os.path.join(self.users_dir, user_id)
         if os.path.exists(user_dir):
             shutil.rmtree(user_dir)
+        self._index_user_email(user_id, None)
+        
+        class_index = self._current_class_index()
+        owned = [cid for cid, tid in class_index.items() if tid == user_id]
+        if owned:
+            for class_id in owned:
+                del class_index[class_id]
+            self._save_class_index()
     
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        """Get user by email"""
-        if not os.path.exists(self.users_dir):
+        """Get user by email via the email index"""
+        user_id = self._load_email_index().get(email)
+        if not user_id and self._reload_email_index_if_changed():
+            user_id = self._email_index.get(email)
+        if not user_id:
             return None
-        
-        for user_id in os.listdir(self.users_dir):
-            user = self.get_user(user_id)
-            if user and user.get('email') == email:
-                return user
+        user = self.get_user(user_id)
+        if user and user.get('email') == email:
+            return user
         return None
     
     def create_class(self, teacher_id: str, class_id: str, class_data: Dict[str, Any]) -> None:
         """Create a new class"""
-        classes_dir = os.path.join(self.users_dir, teacher_id, "classes")
-        os.makedirs(classes_dir, exist_ok=True)
-        class_file = os.path.join(classes_dir, f"class_{class_id}.json")
-        class_data['created_at'] = datetime.utcnow().isoformat()
+        class_file = self._class_fmt.format(teacher_id, class_id)
+        class_data['created_at'] = _now_iso()
         self._write_json(class_file, class_data)
+        
+        class_index = self._current_class_index()
+        if class_index.get(class_id) != teacher_id:
+            class_index[class_id] = teacher_id
+            self._save_class_index()
     
-    def get_class(self, class_id: str) -> Optional[Dict[str, Any]]:
-        """Get class by ID - searches across all teachers"""
-        if not os.path.exists(self.users_dir):
+    def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get class by ID via the class index"""
+        teacher_id = self._class_teacher(class_id)
+        if not teacher_id:
             return None
-        
-        for teacher_id in os.listdir(self.users_dir):
-            class_file = os.path.join(self.users_dir, teacher_id, "classes", f"class_{class_id}.json")
-            class_data = self._read_json(class_file)
-            if class_data:
-                return class_data
-        return None
+        return _project(self._read_json(self._class_fmt.format(teacher_id, class_id)), fields)
     
     def update_class(self, class_id: str, class_data: Dict[str, Any]) -> None:
         """Update class data"""
-        # Find the teacher for this class
-        teacher_id = class_data.get('teacher_id')
-        if not teacher_id:
-            # Search for it
-            existing = self.get_class(class_id)
-            if existing:
-                teacher_id = existing.get('teacher_id')
+        teacher_id = self._class_teacher(class_id) or class_data.get('teacher_id')
         
         if teacher_id:
-            class_file = os.path.join(self.users_dir, teacher_id, "classes", f"class_{class_id}.json")
-            class_data['updated_at'] = datetime.utcnow().isoformat()
-            self._write_json(class_file, class_data)
+            class_data['updated_at'] = _now_iso()
+            self._write_json(self._class_fmt.format(teacher_id, class_id), class_data)
+            class_index = self._current_class_index()
+            if class_index.get(class_id) != teacher_id:
+                class_index[class_id] = teacher_id
+                self._save_class_index()
     
     def delete_class(self, class_id: str) -> None:
         """Delete class"""
-        # Find and delete the class file
-        if not os.path.exists(self.users_dir):
+        teacher_id = self._class_teacher(class_id)
+        if not teacher_id:
             return
-        
-        for teacher_id in os.listdir(self.users_dir):
-            class_file = os.path.join(self.users_dir, teacher_id, "classes", f"class_{class_id}.json")
-            if os.path.exists(class_file):
-                os.remove(class_file)
-                break
-    
-    def get_all_classes(self, teacher_id: str) -> List[Dict[str, Any]]:
+        class_file = self._class_fmt.format(teacher_id, class_id)
+        if os.path.exists(class_file):
+            os.remove(class_file)
+        class_index = self._current_class_index()
+        if class_index.pop(class_id, None) is not None:
+            self._save_class_index()
+    
+    def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all classes for a teacher"""
         classes_dir = os.path.join(self.users_dir, teacher_id, "classes")
         if not os.path.exists(classes_dir):
@@ -438,119 +1293,551 @@ class FileBackend(DatabaseBackend):
             if filename.startswith("class_") and filename.endswith(".json"):
                 class_data = self._read_json(os.path.join(classes_dir, filename))
                 if class_data:
-                    classes.append(class_data)
+                    classes.append(_project(class_data, fields))
         return classes
     
     def create_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
         """Create a new student"""
-        student_dir = os.path.join(self.students_dir, student_id)
-        os.makedirs(student_dir, exist_ok=True)
-        student_file = os.path.join(student_dir, "student.json")
-        student_data['created_at'] = datetime.utcnow().isoformat()
+        student_file = self._student_fmt.format(student_id)
+        student_data['created_at'] = _now_iso()
         self._write_json(student_file, student_data)
     
     def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
         """Get student by ID"""
-        student_file = os.path.join(self.students_dir, student_id, "student.json")
+        student_file = self._student_fmt.format(student_id)
         return self._read_json(student_file)
     
     def update_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
         """Update student data"""
-        student_file = os.path.join(self.students_dir, student_id, "student.json")
-        student_data['updated_at'] = datetime.utcnow().isoformat()
+        student_file = self._student_fmt.format(student_id)
+        student_data['updated_at'] = _now_iso()
         self._write_json(student_file, student_data)
     
     def create_enrollment(self, enrollment_data: Dict[str, Any]) -> None:
         """Create enrollment record"""
         class_id = enrollment_data.get('class_id')
-        enrollment_file = os.path.join(self.enrollments_dir, f"class_{class_id}_enrollments.json")
+        enrollment_file = self._enrollment_fmt.format(class_id)
         
         enrollments = self._read_json(enrollment_file) or []
-        enrollment_data['created_at'] = datetime.utcnow().isoformat()
+        enrollment_data['created_at'] = _now_iso()
         enrollments.append(enrollment_data)
         self._write_json(enrollment_file, enrollments)
     
-    def get_enrollments(self, class_id: str) -> List[Dict[str, Any]]:
+    def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        """Create many enrollment records - one read/write per class file"""
+        by_class: Dict[str, List[Dict[str, Any]]] = {}
+        for enrollment_data in enrollments:
+            by_class.setdefault(enrollment_data.get('class_id'), []).append(enrollment_data)
+        
+        created_at = _now_iso()
+        for class_id, new_enrollments in by_class.items():
+            enrollment_file = self._enrollment_fmt.format(class_id)
+            existing = self._read_json(enrollment_file) or []
+            for enrollment_data in new_enrollments:
+                enrollment_data['created_at'] = created_at
+            existing.extend(new_enrollments)
+            self._write_json(enrollment_file, existing)
+    
+    def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Get all enrollments for a class"""
-        enrollment_file = os.path.join(self.enrollments_dir, f"class_{class_id}_enrollments.json")
-        return self._read_json(enrollment_file) or []
+        enrollment_file = self._enrollment_fmt.format(class_id)
+        enrollments = self._read_json(enrollment_file) or []
+        if fields is None:
+            return enrollments
+        return [_project(e, fields) for e in enrollments]
     
-    def update_enrollment(self, class_id: str, student_id: str, enrollment_data: Dict[str, Any]) -> None:
-        """Update enrollment status"""
-        enrollment_file = os.path.join(self.enrollments_dir, f"class_{class_id}_enrollments.json")
+    def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        """Update only the given enrollment fields, creating the enrollment if it doesn't exist"""
+        enrollment_file = self._enrollment_fmt.format(class_id)
         enrollments = self._read_json(enrollment_file) or []
         
         for enrollment in enrollments:
             if enrollment.get('student_id') == student_id:
-                enrollment.update(enrollment_data)
-                enrollment['updated_at'] = datetime.utcnow().isoformat()
                 break
+        else:
+            enrollment = {"class_id": class_id, "student_id": student_id}
+            enrollments.append(enrollment)
+        _apply_update(enrollment, updates)
+        enrollment['updated_at'] = _now_iso()
         
         self._write_json(enrollment_file, enrollments)
     
+    def _ensure_contact_index(self) -> None:
+        """Build contact/_index.jsonl from the message files if it doesn't exist yet"""
+        if os.path.exists(self._contact_index_path):
+            return
+        lines = []
+        for filename in os.listdir(self.contact_dir):
+            if filename.startswith('message_') and filename.endswith('.json'):
+                message = self._read_json(os.path.join(self.contact_dir, filename))
+                if message:
+                    lines.append(self._contact_index_line(message, filename))
+        with open(self._contact_index_path, 'wb') as f:
+            f.write(b"".join(lines))
+    
+    @staticmethod
+    def _contact_index_line(message: Dict[str, Any], filename: str) -> bytes:
+        entry = {"email": message.get('email'), "filename": filename, "created_at": message.get('created_at', '')}
+        return json.dumps(entry, ensure_ascii=False).encode('utf-8') + b"\n"
+    
+    def _append_contact_index(self, entries: List[Tuple[Dict[str, Any], str]]) -> None:
+        with open(self._contact_index_path, 'ab') as f:
+            f.write(b"".join(self._contact_index_line(m, fn) for m, fn in entries))
+    
     def save_contact_message(self, message_data: Dict[str, Any]) -> None:
         """Save contact form message"""
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        message_file = os.path.join(self.contact_dir, f"message_{timestamp}.json")
-        message_data['created_at'] = datetime.utcnow().isoformat()
-        self._write_json(message_file, message_data)
+        with self._contact_lock:
+            self._ensure_contact_index()
+            timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+            filename = f"message_{timestamp}.json"
+            message_data['created_at'] = _now_iso()
+            self._write_json(self._contact_fmt.format(filename), message_data)
+            self._append_contact_index([(message_data, filename)])
+    
+    def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """Save many contact form messages"""
+        with self._contact_lock:
+            self._ensure_contact_index()
+            now = datetime.utcnow()
+            timestamp = now.strftime("%Y%m%d_%H%M%S_%f")
+            created_at = now.isoformat()
+            entries = []
+            for i, message_data in enumerate(messages):
+                filename = f"message_{timestamp}_{i:06d}.json"
+                message_data['created_at'] = created_at
+                self._write_json(self._contact_fmt.format(filename), message_data)
+                entries.append((message_data, filename))
+            self._append_contact_index(entries)
     
     def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get contact messages"""
-        if not os.path.exists(self.contact_dir):
-            return []
+        """Get contact messages, newest first - filters and sorts the index, then opens matching files"""
+        with self._contact_lock:
+            self._ensure_contact_index()
+            with open(self._contact_index_path, 'rb') as f:
+                lines = f.readlines()
+        entries = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Torn or half-written line (e.g. another process mid-append)
+                continue
+        if email is not None:
+            entries = [e for e in entries if e.get('email') == email]
+        # File names carry a microsecond timestamp, so they break created_at ties
+        entries.sort(key=lambda e: (e.get('created_at', ''), e['filename']), reverse=True)
         
         messages = []
-        for filename in os.listdir(self.contact_dir):
-            if filename.endswith('.json'):
-                message = self._read_json(os.path.join(self.contact_dir, filename))
-                if message:
-                    if email is None or message.get('email') == email:
-                        messages.append(message)
-        
-        return sorted(messages, key=lambda x: x.get('created_at', ''), reverse=True)
+        for entry in entries:
+            message = self._read_json(self._contact_fmt.format(entry['filename']))
+            if message:
+                messages.append(message)
+        return messages
     
     def create_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
         """Create QR session"""
-        session_file = os.path.join(self.qr_sessions_dir, f"class_{class_id}_{date}.json")
+        session_file = self._qr_session_fmt.format(class_id, date)
         self._write_json(session_file, session_data)
     
     def get_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
         """Get QR session"""
-        session_file = os.path.join(self.qr_sessions_dir, f"class_{class_id}_{date}.json")
+        session_file = self._qr_session_fmt.format(class_id, date)
         return self._read_json(session_file)
     
     def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
         """Update QR session"""
-        session_file = os.path.join(self.qr_sessions_dir, f"class_{class_id}_{date}.json")
-        session_data['updated_at'] = datetime.utcnow().isoformat()
+        session_file = self._qr_session_fmt.format(class_id, date)
+        session_data['updated_at'] = _now_iso()
         self._write_json(session_file, session_data)
 
 
+class SqliteBackend(DatabaseBackend):
+    """SQLite implementation of database backend (WAL mode, JSON documents stored as blobs)"""
+    
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY, email TEXT, data BLOB NOT NULL);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email);
+        CREATE TABLE IF NOT EXISTS classes (
+            class_id TEXT PRIMARY KEY, teacher_id TEXT, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_classes_teacher ON classes(teacher_id);
+        CREATE TABLE IF NOT EXISTS students (
+            student_id TEXT PRIMARY KEY, email TEXT, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_students_email ON students(email);
+        CREATE TABLE IF NOT EXISTS enrollments (
+            class_id TEXT NOT NULL, student_id TEXT NOT NULL, data BLOB NOT NULL,
+            PRIMARY KEY (class_id, student_id));
+        CREATE TABLE IF NOT EXISTS contact_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT, created_at TEXT, data BLOB NOT NULL);
+        CREATE INDEX IF NOT EXISTS idx_contact_email_created ON contact_messages(email, created_at);
+        CREATE TABLE IF NOT EXISTS qr_sessions (
+            class_id TEXT NOT NULL, date TEXT NOT NULL, data BLOB NOT NULL,
+            PRIMARY KEY (class_id, date));
+    """
+    
+    def __init__(self, db_path: str = "data/lernova.db"):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self._SCHEMA)
+        print(f"✅ SQLite database ready: {db_path}")
+    
+    def _conn(self):
+        """One connection per thread; WAL lets readers proceed while a writer commits"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    @staticmethod
+    def _encode(data: Dict[str, Any]) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    
+    def _fetch_one(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(sql, params).fetchone()
+        return _loads_json(row[0]) if row else None
+    
+    def _fetch_all(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        return [_loads_json(row[0]) for row in self._conn().execute(sql, params)]
+    
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, joining the transaction already open on this thread if any"""
+        conn = self._conn()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    
+    def _merge(self, select_sql: str, key: tuple, updates: Dict[str, Any], write) -> None:
+        """Read-merge-write a document inside one transaction ($set semantics)"""
+        with self._transaction() as conn:
+            row = conn.execute(select_sql, key).fetchone()
+            if row:
+                doc = _loads_json(row[0])
+                doc.update(updates)
+                write(conn, doc)
+    
+    def create_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
+        """Create a new user"""
+        user_data['user_id'] = user_id
+        user_data['created_at'] = _now_iso()
+        self._conn().execute(
+            "INSERT INTO users (user_id, email, data) VALUES (?, ?, ?)",
+            (user_id, user_data.get('email'), self._encode(user_data))
+        )
+    
+    def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        return _project(self._fetch_one("SELECT data FROM users WHERE user_id = ?", (user_id,)), fields)
+    
+    def update_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
+        """Update user data"""
+        user_data['updated_at'] = _now_iso()
+        self._merge(
+            "SELECT data FROM users WHERE user_id = ?", (user_id,), user_data,
+            lambda conn, doc: conn.execute(
+                "UPDATE users SET email = ?, data = ? WHERE user_id = ?",
+                (doc.get('email'), self._encode(doc), user_id)
+            )
+        )
+    
+    def delete_user(self, user_id: str) -> None:
+        """Delete user"""
+        self._conn().execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+    
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get user by email"""
+        return self._fetch_one("SELECT data FROM users WHERE email = ?", (email,))
+    
+    def create_class(self, teacher_id: str, class_id: str, class_data: Dict[str, Any]) -> None:
+        """Create a new class"""
+        class_data['class_id'] = class_id
+        class_data['teacher_id'] = teacher_id
+        class_data['created_at'] = _now_iso()
+        self._conn().execute(
+            "INSERT INTO classes (class_id, teacher_id, data) VALUES (?, ?, ?)",
+            (class_id, teacher_id, self._encode(class_data))
+        )
+    
+    def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get class by ID"""
+        return _project(self._fetch_one("SELECT data FROM classes WHERE class_id = ?", (class_id,)), fields)
+    
+    def update_class(self, class_id: str, class_data: Dict[str, Any]) -> None:
+        """Update class data"""
+        class_data['updated_at'] = _now_iso()
+        self._merge(
+            "SELECT data FROM classes WHERE class_id = ?", (class_id,), class_data,
+            lambda conn, doc: conn.execute(
+                "UPDATE classes SET teacher_id = ?, data = ? WHERE class_id = ?",
+                (doc.get('teacher_id'), self._encode(doc), class_id)
+            )
+        )
+    
+    def update_attendance(self, class_id: str, marks: List[Tuple[Any, str, Any]]) -> None:
+        """Set attendance marks of a class inside one transaction"""
+        def apply(conn, doc):
+            _apply_attendance_marks(doc, marks)
+            doc['updated_at'] = _now_iso()
+            conn.execute("UPDATE classes SET data = ? WHERE class_id = ?", (self._encode(doc), class_id))
+        self._merge("SELECT data FROM classes WHERE class_id = ?", (class_id,), {}, apply)
+    
+    def delete_class(self, class_id: str) -> None:
+        """Delete class"""
+        self._conn().execute("DELETE FROM classes WHERE class_id = ?", (class_id,))
+    
+    def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get all classes for a teacher"""
+        classes = self._fetch_all("SELECT data FROM classes WHERE teacher_id = ? ORDER BY rowid", (teacher_id,))
+        if fields is None:
+            return classes
+        return [_project(c, fields) for c in classes]
+    
+    def create_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
+        """Create a new student"""
+        student_data['student_id'] = student_id
+        student_data['created_at'] = _now_iso()
+        self._conn().execute(
+            "INSERT INTO students (student_id, email, data) VALUES (?, ?, ?)",
+            (student_id, student_data.get('email'), self._encode(student_data))
+        )
+    
+    def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """Get student by ID"""
+        return self._fetch_one("SELECT data FROM students WHERE student_id = ?", (student_id,))
+    
+    def update_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
+        """Update student data"""
+        student_data['updated_at'] = _now_iso()
+        self._merge(
+            "SELECT data FROM students WHERE student_id = ?", (student_id,), student_data,
+            lambda conn, doc: conn.execute(
+                "UPDATE students SET email = ?, data = ? WHERE student_id = ?",
+                (doc.get('email'), self._encode(doc), student_id)
+            )
+        )
+    
+    def create_enrollment(self, enrollment_data: Dict[str, Any]) -> None:
+        """Create enrollment record"""
+        self.bulk_create_enrollments([enrollment_data])
+    
+    def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        """Create many enrollment records in one transaction"""
+        created_at = _now_iso()
+        rows = []
+        for enrollment_data in enrollments:
+            enrollment_data['created_at'] = created_at
+            rows.append((enrollment_data.get('class_id'), enrollment_data.get('student_id'),
+                         self._encode(enrollment_data)))
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO enrollments (class_id, student_id, data) VALUES (?, ?, ?)", rows
+            )
+    
+    def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get all enrollments for a class"""
+        enrollments = self._fetch_all("SELECT data FROM enrollments WHERE class_id = ? ORDER BY rowid", (class_id,))
+        if fields is None:
+            return enrollments
+        return [_project(e, fields) for e in enrollments]
+    
+    def get_active_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get the active enrollments for a class, filtered by SQLite's JSON functions"""
+        enrollments = self._fetch_all(
+            "SELECT data FROM enrollments WHERE class_id = ? "
+            "AND json_extract(CAST(data AS TEXT), '$.status') = 'active' ORDER BY rowid",
+            (class_id,)
+        )
+        if fields is None:
+            return enrollments
+        return [_project(e, fields) for e in enrollments]
+    
+    def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        """Update only the given enrollment fields, creating the enrollment if it doesn't exist"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM enrollments WHERE class_id = ? AND student_id = ?", (class_id, student_id)
+            ).fetchone()
+            doc = _loads_json(row[0]) if row else {"class_id": class_id, "student_id": student_id}
+            _apply_update(doc, updates)
+            doc['updated_at'] = _now_iso()
+            conn.execute(
+                "INSERT OR REPLACE INTO enrollments (class_id, student_id, data) VALUES (?, ?, ?)",
+                (class_id, student_id, self._encode(doc))
+            )
+    
+    def save_contact_message(self, message_data: Dict[str, Any]) -> None:
+        """Save contact form message"""
+        self.bulk_save_contact_messages([message_data])
+    
+    def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None:
+        """Save many contact form messages in one transaction"""
+        created_at = _now_iso()
+        rows = []
+        for message_data in messages:
+            message_data['created_at'] = created_at
+            rows.append((message_data.get('email'), created_at, self._encode(message_data)))
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO contact_messages (email, created_at, data) VALUES (?, ?, ?)", rows
+            )
+    
+    def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get contact messages, newest first"""
+        if email is None:
+            return self._fetch_all("SELECT data FROM contact_messages ORDER BY created_at DESC, id DESC", ())
+        return self._fetch_all(
+            "SELECT data FROM contact_messages WHERE email = ? ORDER BY created_at DESC, id DESC", (email,)
+        )
+    
+    def create_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
+        """Create QR session"""
+        session_data['class_id'] = class_id
+        session_data['date'] = date
+        self._conn().execute(
+            "INSERT OR REPLACE INTO qr_sessions (class_id, date, data) VALUES (?, ?, ?)",
+            (class_id, date, self._encode(session_data))
+        )
+    
+    def get_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """Get QR session"""
+        return self._fetch_one("SELECT data FROM qr_sessions WHERE class_id = ? AND date = ?", (class_id, date))
+    
+    def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
+        """Update QR session"""
+        session_data['updated_at'] = _now_iso()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM qr_sessions WHERE class_id = ? AND date = ?", (class_id, date)
+            ).fetchone()
+            doc = _loads_json(row[0]) if row else {"class_id": class_id, "date": date}
+            doc.update(session_data)
+            conn.execute(
+                "INSERT OR REPLACE INTO qr_sessions (class_id, date, data) VALUES (?, ?, ?)",
+                (class_id, date, self._encode(doc))
+            )
+    
+    def update_qr_code(self, class_id: str, date: str, current_code: str, code_generated_at: str) -> bool:
+        """Persist a rotated QR code, only if the stored session is still active"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM qr_sessions WHERE class_id = ? AND date = ?", (class_id, date)
+            ).fetchone()
+            doc = _loads_json(row[0]) if row else None
+            if not doc or doc.get('status') != _STATUS_ACTIVE:
+                return False
+            doc['current_code'] = current_code
+            doc['code_generated_at'] = code_generated_at
+            doc['updated_at'] = _now_iso()
+            conn.execute(
+                "UPDATE qr_sessions SET data = ? WHERE class_id = ? AND date = ?",
+                (self._encode(doc), class_id, date)
+            )
+        return True
+    
+    def batch_update(self, ops: List[Tuple[str, Tuple, Any]]) -> None:
+        """Apply class / QR session updates inside a single transaction"""
+        with self._transaction():
+            super().batch_update(ops)
+
+
 class DatabaseManager:
     """
     Unified Database Manager that works with multiple backends
     Automatically selects backend based on configuration
     """
     
+    # Delegates with no caching or queueing of their own; __init__ binds the backend's
+    # methods straight onto the instance so calls skip the wrapper frame
+    _PASSTHROUGH_METHODS = (
+        'get_user_by_email', 'get_all_classes', 'bulk_save_contact_messages', 'get_contact_messages',
+        'iter_all_classes', 'iter_enrollments', 'iter_contact_messages',
+    )
+    
+    if TYPE_CHECKING:
+        # Signatures of the pass-through methods for type checkers and editors only
+        def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]: ...
+        def get_all_classes(self, teacher_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]: ...
+        def bulk_save_contact_messages(self, messages: List[Dict[str, Any]]) -> None: ...
+        def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]: ...
+        def iter_all_classes(self, teacher_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]: ...
+        def iter_enrollments(self, class_id: str, batch_size: int = 500) -> Iterator[Dict[str, Any]]: ...
+        def iter_contact_messages(self, email: Optional[str] = None, batch_size: int = 500) -> Iterator[Dict[str, Any]]: ...
+    
     def __init__(self, backend_type: str = "file", **kwargs):
         """
         Initialize database manager with specified backend
         
         Args:
-            backend_type: "file" or "mongodb"
+            backend_type: "file", "sqlite", "mongodb" or "mongodb_async"
             **kwargs: Backend-specific configuration
+                For all: cache_size (default: 4096), cache_ttl seconds (default: 5.0, 0 disables),
+                    write_behind_interval seconds the background writer waits to batch
+                    low-priority writes (default: 0.05), qr_recheck_interval seconds an
+                    in-memory active QR session is trusted before re-reading storage (default: 1.0)
                 For file: base_dir (default: "data")
-                For mongodb: mongo_uri (required), database_name (default: "lernova_db")
+                For sqlite: db_path (default: "data/lernova.db")
+                For mongodb: mongo_uri (required), database_name (default: "lernova_db"),
+                    max_pool_size (200), min_pool_size (10), max_idle_time_ms (300000),
+                    socket_timeout_ms (30000), server_selection_timeout_ms (5000),
+                    compressors ("zstd,zlib"), zlib_compression_level (6)
+                For mongodb_async: same as mongodb. The synchronous methods keep working
+                    and the Motor backend is available as `aio` for `async def` handlers,
+                    e.g. `await db.aio.get_user(user_id)`. Writes through `aio` invalidate
+                    this manager's caches; other processes still see them after cache_ttl
         """
         self.backend_type = backend_type
-        
-        if backend_type == "mongodb":
+        self._cache = _TTLCache(kwargs.get('cache_size', 4096), kwargs.get('cache_ttl', 5.0))
+        
+        # Active QR sessions live in memory; code rotations are flushed in the background
+        self._active_qr: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._dirty_qr: set = set()
+        # scanned_students of each active session as a set, for O(1) duplicate checks
+        self._qr_scanned: Dict[Tuple[str, str], set] = {}
+        # When each live session was last confirmed against storage (another process may stop it)
+        self._qr_checked: Dict[Tuple[str, str], float] = {}
+        self._qr_recheck_interval = kwargs.get('qr_recheck_interval', 1.0)
+        # A session's entries in the maps above only change under its own lock (_qr_session_lock),
+        # which is held across that session's storage I/O. _qr_lock only guards the shared maps
+        # and is never held across I/O, so sessions of other classes/dates don't wait on it
+        self._qr_lock = threading.Lock()
+        self._qr_session_locks: Dict[Tuple[str, str], List[Any]] = {}
+        
+        self.aio: Optional[_AsyncManagedBackend] = None
+        
+        if backend_type in ("mongodb", "mongodb_async"):
             mongo_uri = kwargs.get('mongo_uri')
             if not mongo_uri:
                 raise ValueError("mongo_uri is required for MongoDB backend")
             database_name = kwargs.get('database_name', 'lernova_db')
-            self.backend = MongoDBBackend(mongo_uri, database_name)
+            pool_options = {
+                key: kwargs[key]
+                for key in ('max_pool_size', 'min_pool_size', 'max_idle_time_ms',
+                            'socket_timeout_ms', 'server_selection_timeout_ms',
+                            'compressors', 'zlib_compression_level')
+                if key in kwargs
+            }
+            self.backend = MongoDBBackend(mongo_uri, database_name, **pool_options)
+            if backend_type == "mongodb_async":
+                self.aio = _AsyncManagedBackend(AsyncMongoDBBackend(mongo_uri, database_name, **pool_options), self)
             print(f"✅ DatabaseManager initialized with MongoDB backend")
             
         elif backend_type == "file":
@@ -558,119 +1845,456 @@ class DatabaseManager:
             self.backend = FileBackend(base_dir)
             print(f"✅ DatabaseManager initialized with File backend (dir: {base_dir})")
             
+        elif backend_type == "sqlite":
+            db_path = kwargs.get('db_path', os.path.join('data', 'lernova.db'))
+            self.backend = SqliteBackend(db_path)
+            print(f"✅ DatabaseManager initialized with SQLite backend (db: {db_path})")
+            
         else:
             raise ValueError(f"Unsupported backend type: {backend_type}")
+        
+        for name in self._PASSTHROUGH_METHODS:
+            setattr(self, name, getattr(self.backend, name))
+        
+        # Write-behind queue for low-priority writes (contact messages, QR code rotations)
+        self._write_queue: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue(maxsize=10_000)
+        self._write_behind_interval = kwargs.get('write_behind_interval', 0.05)
+        self._writer = threading.Thread(target=self._write_behind_loop, name="db-write-behind", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+    
+    def _cached_read(self, key: Tuple, loader, fields: Optional[List[str]] = None):
+        """Serve a read from the in-process cache, loading and storing it on a miss.
+        
+        Documents are cached as pickled bytes, so every hit decodes a fresh object the
+        caller may edit freely (several times cheaper than deep-copying a live document).
+        Projected reads (fields given) are answered from a cached full document when one
+        is present, otherwise they go straight to the backend with the projection.
+        """
+        cached = self._cache.get(key)
+        if cached is _TTLCache._MISSING:
+            if fields is not None:
+                return loader(fields)
+            value = loader(None)
+            if self._cache.ttl > 0:
+                self._cache.set(key, self._freeze(value))
+            return value
+        value = pickle.loads(cached)
+        if fields is not None:
+            if isinstance(value, list):
+                return [_project(v, fields) for v in value]
+            return _project(value, fields)
+        return value
+    
+    @staticmethod
+    def _freeze(value: Any) -> bytes:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    def _refresh_cached_attendance(self, key: Tuple, marks: List[Tuple[Any, str, Any]]) -> None:
+        """
+        Write-through for attendance mark updates: apply them to a cached class so
+        back-to-back requests (e.g. a burst of scans on one class) skip the re-read.
+        Marks land the same way on every backend; whole-document updates are not written
+        through, since the file backend replaces the document where the others merge fields
+        """
+        cached = self._cache.get(key)
+        doc = None if cached is _TTLCache._MISSING else pickle.loads(cached)
+        if doc is None:
+            self._cache.invalidate(key)
+            return
+        _apply_attendance_marks(doc, marks)
+        self._cache.set(key, self._freeze(doc))
     
-    # Delegate all methods to the backend
+    # Delegate all methods to the backend (pass-through ones are bound in __init__)
     def create_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
-        return self.backend.create_user(user_id, user_data)
+        self.backend.create_user(user_id, user_data)
+        self._cache.invalidate(("user", user_id))
     
-    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
-        return self.backend.get_user(user_id)
+    def get_user(self, user_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self._cached_read(("user", user_id),
+                                 lambda f: self.backend.get_user(user_id, f), fields)
     
     def update_user(self, user_id: str, user_data: Dict[str, Any]) -> None:
-        return self.backend.update_user(user_id, user_data)
+        self.backend.update_user(user_id, user_data)
+        self._cache.invalidate(("user", user_id))
     
     def delete_user(self, user_id: str) -> None:
-        return self.backend.delete_user(user_id)
-    
-    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        return self.backend.get_user_by_email(email)
+        self.backend.delete_user(user_id)
+        self._cache.invalidate(("user", user_id))
     
     def create_class(self, teacher_id: str, class_id: str, class_data: Dict[str, Any]) -> None:
-        return self.backend.create_class(teacher_id, class_id, class_data)
+        self.backend.create_class(teacher_id, class_id, class_data)
+        self._cache.invalidate(("class", class_id))
     
-    def get_class(self, class_id: str) -> Optional[Dict[str, Any]]:
-        return self.backend.get_class(class_id)
+    def get_class(self, class_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        return self._cached_read(("class", class_id),
+                                 lambda f: self.backend.get_class(class_id, f), fields)
     
     def update_class(self, class_id: str, class_data: Dict[str, Any]) -> None:
-        return self.backend.update_class(class_id, class_data)
+        self.backend.update_class(class_id, class_data)
+        self._cache.invalidate(("class", class_id))
     
     def delete_class(self, class_id: str) -> None:
-        return self.backend.delete_class(class_id)
-    
-    def get_all_classes(self, teacher_id: str) -> List[Dict[str, Any]]:
-        return self.backend.get_all_classes(teacher_id)
+        self.backend.delete_class(class_id)
+        self._cache.invalidate(("class", class_id))
     
     def create_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
-        return self.backend.create_student(student_id, student_data)
+        self.backend.create_student(student_id, student_data)
+        self._cache.invalidate(("student", student_id))
     
     def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
-        return self.backend.get_student(student_id)
+        return self._cached_read(("student", student_id), lambda f: self.backend.get_student(student_id))
     
     def update_student(self, student_id: str, student_data: Dict[str, Any]) -> None:
-        return self.backend.update_student(student_id, student_data)
+        self.backend.update_student(student_id, student_data)
+        self._cache.invalidate(("student", student_id))
     
     def create_enrollment(self, enrollment_data: Dict[str, Any]) -> None:
-        return self.backend.create_enrollment(enrollment_data)
+        self.backend.create_enrollment(enrollment_data)
+        self._invalidate_enrollments(enrollment_data.get('class_id'))
     
-    def get_enrollments(self, class_id: str) -> List[Dict[str, Any]]:
-        return self.backend.get_enrollments(class_id)
+    def bulk_create_enrollments(self, enrollments: List[Dict[str, Any]]) -> None:
+        self.backend.bulk_create_enrollments(enrollments)
+        for class_id in {e.get('class_id') for e in enrollments}:
+            self._invalidate_enrollments(class_id)
     
-    def update_enrollment(self, class_id: str, student_id: str, enrollment_data: Dict[str, Any]) -> None:
-        return self.backend.update_enrollment(class_id, student_id, enrollment_data)
+    def get_enrollments(self, class_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self._cached_read(("enrollments", class_id),
+                                 lambda f: self.backend.get_enrollments(class_id, f), fields)
     
-    def save_contact_message(self, message_data: Dict[str, Any]) -> None:
-        return self.backend.save_contact_message(message_data)
+    def get_active_enrollments(self, class_id: str) -> List[Dict[str, Any]]:
+        return copy.deepcopy(list(self._get_enrollment_index(class_id).values()))
     
-    def get_contact_messages(self, email: Optional[str] = None) -> List[Dict[str, Any]]:
-        return self.backend.get_contact_messages(email)
+    def update_enrollment(self, class_id: str, student_id: str, updates: Dict[str, Any]) -> None:
+        self.backend.update_enrollment(class_id, student_id, updates)
+        self._invalidate_enrollments(class_id)
+    
+    def _invalidate_enrollments(self, class_id: str) -> None:
+        self._cache.invalidate(("enrollments", class_id))
+        self._cache.invalidate(("enrollment_index", class_id))
+    
+    def _get_enrollment_index(self, class_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Active enrollments of a class keyed by student_id, cached next to the enrollment list
+        The returned mapping is shared - treat it as read-only
+        """
+        key = ("enrollment_index", class_id)
+        index = self._cache.get(key)
+        if index is _TTLCache._MISSING:
+            index = {e['student_id']: e for e in self.backend.get_active_enrollments(class_id)}
+            self._cache.set(key, index)
+        return index
+    
+    def save_contact_message(self, message_data: Dict[str, Any]) -> None:
+        """Queue a contact message; it is written in the next background batch"""
+        self._enqueue_write("contact_message", message_data)
     
     def create_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
-        return self.backend.create_qr_session(class_id, date, session_data)
+        with self._qr_session_lock(class_id, date):
+            self.backend.create_qr_session(class_id, date, session_data)
+            self._cache.invalidate(("qr_session", class_id, date))
+            with self._qr_lock:
+                self._qr_scanned.pop((class_id, date), None)
+            self._remember_qr_session(class_id, date, session_data)
     
     def get_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
-        return self.backend.get_qr_session(class_id, date)
+        with self._qr_session_lock(class_id, date):
+            live = self._live_qr_session(class_id, date)
+            if live is not None:
+                return copy.deepcopy(live)
+        return self._cached_read(("qr_session", class_id, date),
+                                 lambda f: self.backend.get_qr_session(class_id, date))
     
     def update_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
-        return self.backend.update_qr_session(class_id, date, session_data)
+        with self._qr_session_lock(class_id, date):
+            self.backend.update_qr_session(class_id, date, session_data)
+            self._cache.invalidate(("qr_session", class_id, date))
+            self._remember_qr_session(class_id, date, session_data)
+    
+    def batch_update(self, ops: List[Tuple[str, Tuple, Any]]) -> None:
+        """Commit class / QR session updates together (see DatabaseBackend.batch_update)"""
+        if not ops:
+            return
+        with ExitStack() as locks:
+            # Sorted, so two batches touching the same sessions can't deadlock
+            for class_id, date in sorted({key for kind, key, _ in ops if kind == "qr_session"}):
+                locks.enter_context(self._qr_session_lock(class_id, date))
+            self.backend.batch_update(ops)
+            for kind, key, data in ops:
+                if kind == "attendance":
+                    self._refresh_cached_attendance(("class",) + key, data)
+                    continue
+                self._cache.invalidate((kind,) + key)
+                if kind == "qr_session":
+                    self._remember_qr_session(*key, data)
+    
+    # ==================== IN-MEMORY QR SESSIONS ====================
+    
+    @contextmanager
+    def _qr_session_lock(self, class_id: str, date: str) -> Iterator[None]:
+        """Serialise work on one class/date QR session (reentrant); other sessions proceed in parallel"""
+        key = (class_id, date)
+        with self._qr_lock:
+            entry = self._qr_session_locks.get(key)
+            if entry is None:
+                entry = self._qr_session_locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._qr_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._qr_session_locks[key]
+    
+    def _remember_qr_session(self, class_id: str, date: str, session_data: Dict[str, Any]) -> None:
+        """Mirror a just-persisted QR session into memory, or drop it once inactive (caller holds its lock)"""
+        key = (class_id, date)
+        if session_data.get("status") != _STATUS_ACTIVE:
+            self._forget_qr_session(key)
+            return
+        live = copy.deepcopy(session_data)
+        with self._qr_lock:
+            self._dirty_qr.discard(key)
+            self._active_qr[key] = live
+            self._qr_checked[key] = time.monotonic()
+            if key not in self._qr_scanned:
+                self._qr_scanned[key] = set(live.get("scanned_students", ()))
+    
+    def _forget_qr_session(self, key: Tuple[str, str]) -> None:
+        """Drop every in-memory trace of a QR session"""
+        with self._qr_lock:
+            self._active_qr.pop(key, None)
+            self._qr_scanned.pop(key, None)
+            self._qr_checked.pop(key, None)
+            self._dirty_qr.discard(key)
+        self._cache.invalidate(("qr_session",) + key)
+    
+    def _track_qr_session(self, key: Tuple[str, str], session_data: Dict[str, Any], now: float) -> None:
+        """Make a session read from storage the live copy (caller holds its lock)"""
+        with self._qr_lock:
+            live = self._active_qr.get(key)
+            if live is not None and key in self._dirty_qr:
+                # Keep our rotated code until the background flush has written it
+                session_data["current_code"] = live["current_code"]
+                session_data["code_generated_at"] = live["code_generated_at"]
+            self._active_qr[key] = session_data
+            self._qr_scanned[key] = set(session_data.get("scanned_students", ()))
+            self._qr_checked[key] = now
+    
+    def _live_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """
+        The in-memory copy of an active QR session (caller holds its _qr_session_lock),
+        re-read from storage every qr_recheck_interval seconds so a stop from another
+        process is noticed. Returns None - and forgets the session - once storage no
+        longer has it active
+        """
+        key = (class_id, date)
+        with self._qr_lock:
+            live = self._active_qr.get(key)
+            checked = self._qr_checked.get(key, 0.0)
+        if live is None:
+            return None
+        now = time.monotonic()
+        if now - checked < self._qr_recheck_interval:
+            return live
+        stored = self.backend.get_qr_session(class_id, date)
+        if not stored or stored.get("status") != _STATUS_ACTIVE:
+            self._forget_qr_session(key)
+            return None
+        self._track_qr_session(key, stored, now)
+        return stored
+    
+    def _load_live_qr_session(self, class_id: str, date: str) -> Optional[Dict[str, Any]]:
+        """_live_qr_session, falling back to storage for a session this process isn't tracking yet"""
+        session_data = self._live_qr_session(class_id, date)
+        if session_data is not None:
+            return session_data
+        session_data = self.backend.get_qr_session(class_id, date)
+        if not session_data or session_data.get("status") != _STATUS_ACTIVE:
+            return None
+        self._track_qr_session((class_id, date), session_data, time.monotonic())
+        return session_data
+    
+    def flush_qr_sessions(self) -> None:
+        """Persist the codes of QR sessions that rotated since the last write"""
+        with self._qr_lock:
+            dirty = list(self._dirty_qr)
+        for key in dirty:
+            class_id, date = key
+            with self._qr_session_lock(class_id, date):
+                with self._qr_lock:
+                    if key not in self._dirty_qr:
+                        continue
+                    self._dirty_qr.discard(key)
+                    session_data = self._active_qr.get(key)
+                if session_data is None:
+                    continue
+                try:
+                    # Only the rotated code is written, and only while the stored session is active
+                    if self.backend.update_qr_code(class_id, date, session_data["current_code"],
+                                                   session_data["code_generated_at"]):
+                        self._cache.invalidate(("qr_session", class_id, date))
+                    else:
+                        self._forget_qr_session(key)
+                except Exception:
+                    logger.exception("Error flushing QR session %s/%s", class_id, date)
+                    with self._qr_lock:
+                        self._dirty_qr.add(key)
+    
+    # ==================== WRITE-BEHIND QUEUE ====================
+    
+    def _enqueue_write(self, kind: str, payload: Any) -> None:
+        """Hand a low-priority write to the background writer (synchronous if the queue is full)"""
+        if not self._writer.is_alive():
+            self._apply_writes([(kind, payload)])
+            return
+        try:
+            self._write_queue.put_nowait((kind, payload))
+        except queue.Full:
+            self._apply_writes([(kind, payload)])
+    
+    def _apply_writes(self, items: List[Tuple[str, Any]]) -> None:
+        """Write a batch of queued items, grouped per kind"""
+        messages = [payload for kind, payload in items if kind == "contact_message"]
+        if messages:
+            try:
+                self.backend.bulk_save_contact_messages(messages)
+            except Exception:
+                logger.exception("Error saving %d queued contact messages", len(messages))
+        if any(kind == "qr_session" for kind, _ in items):
+            self.flush_qr_sessions()
+    
+    def _write_behind_loop(self) -> None:
+        """Background writer: wait for work, let a batch accumulate briefly, then write it"""
+        while True:
+            first = self._write_queue.get()
+            stop = first is None
+            items = [] if stop else [first]
+            if not stop:
+                time.sleep(self._write_behind_interval)
+            taken = 1
+            while len(items) < 1000:
+                try:
+                    item = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is None:
+                    stop = True
+                else:
+                    items.append(item)
+            try:
+                self._apply_writes(items)
+            finally:
+                for _ in range(taken):
+                    self._write_queue.task_done()
+            if stop:
+                return
+    
+    def flush(self) -> None:
+        """Block until every queued write has reached the backend"""
+        if self._writer.is_alive():
+            self._write_queue.join()
+    
+    def close(self) -> None:
+        """Flush queued writes and stop the background writer"""
+        if self._writer.is_alive():
+            self._write_queue.put(None)
+            self._writer.join()
     
     # ==================== COMPLEX BUSINESS LOGIC METHODS ====================
     # These methods contain the application logic and use the backend methods
     
     def _generate_qr_code(self) -> str:
         """Generate random QR code"""
-        import random, string
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        return ''.join(_QR_RAND.choices(_QR_ALPHABET, k=8))
+    
+    @staticmethod
+    def _count_day_sessions(day_data: Any) -> int:
+        """Number of sessions with a non-null status in one day's attendance value"""
+        if not day_data:
+            return 0
+        if isinstance(day_data, str):
+            return 1
+        if not isinstance(day_data, dict):
+            return 0
+        if 'sessions' in day_data:
+            return sum(1 for s in day_data['sessions'] if s.get('status') is not None)
+        if day_data.get('status') is not None:
+            return day_data.get('count', 1)
+        return 0
+    
+    @staticmethod
+    def _apply_session_mark(current_value: Any, qr_session_number: int, mark: str, now_iso: str) -> Any:
+        """
+        Attendance value for one day after marking QR session N as mark ('P' or 'A')
+        Session 1 stores the bare mark; later sessions expand the day into a sessions list,
+        keeping an earlier plain mark as session 1. Missing sessions are filled as absent and
+        an existing entry for session N is only overwritten by a present mark.
+        current_value itself is never mutated and is returned as-is when nothing changes
+        """
+        if qr_session_number == 1:
+            return mark
+        
+        session_ids, session_names = _SESSION_IDS, _SESSION_NAMES
+        if qr_session_number >= len(session_ids):
+            session_ids = [f"session_{i}" for i in range(qr_session_number + 1)]
+            session_names = [f"QR Session {i}" for i in range(qr_session_number + 1)]
+        
+        if isinstance(current_value, str) or current_value is None:
+            sessions = [
+                {"id": session_ids[i], "name": session_names[i], "status": _MARK_A}
+                for i in range(1, qr_session_number + 1)
+            ]
+            # N >= 2 here, so the first and last entries are distinct
+            if current_value is not None:
+                sessions[0]["status"] = current_value
+            sessions[-1]["status"] = mark
+        elif isinstance(current_value, dict) and 'sessions' in current_value:
+            by_id = {s.get('id'): s for s in current_value.get('sessions', [])}
+            
+            # Rebuild sessions 1..N in order in one pass, keeping any extra entries after them
+            sessions = []
+            pop_existing = by_id.pop
+            append = sessions.append
+            for i in range(1, qr_session_number + 1):
+                session = pop_existing(session_ids[i], None)
+                if session is None:
+                    session = {
+                        "id": session_ids[i],
+                        "name": session_names[i],
+                        "status": mark if i == qr_session_number else _MARK_A
+                    }
+                elif i == qr_session_number and mark == _MARK_P and session.get('status') != _MARK_P:
+                    session = dict(session, status=_MARK_P)
+                append(session)
+            sessions.extend(by_id.values())
+            if sessions == current_value.get('sessions'):
+                return current_value
+        else:
+            return current_value
+        
+        return {
+            "sessions": sessions,
+            "updated_at": now_iso
+        }
     
     def _count_valid_sessions_for_date(self, class_data: dict, date: str) -> int:
         """
         Count sessions with ACTUAL attendance data for a specific date
         Ignores sessions where all students have null status
         """
-        print(f"[COUNT_VALID] Counting valid sessions for {date}")
-        
-        students = class_data.get('students', [])
-        if not students:
-            print(f"[COUNT_VALID] No students in class")
-            return 0
-        
-        max_sessions = 0
-        
-        for student in students:
-            attendance = student.get('attendance', {})
-            day_data = attendance.get(date)
-            
-            if day_data:
-                if isinstance(day_data, dict) and 'sessions' in day_data:
-                    sessions = day_data.get('sessions', [])
-                    valid_sessions = [s for s in sessions if s.get('status') is not None]
-                    session_count = len(valid_sessions)
-                    max_sessions = max(max_sessions, session_count)
-                elif isinstance(day_data, dict) and 'status' in day_data:
-                    if day_data.get('status') is not None:
-                        count = day_data.get('count', 1)
-                        max_sessions = max(max_sessions, count)
-                elif isinstance(day_data, str):
-                    max_sessions = max(max_sessions, 1)
-        
-        print(f"[COUNT_VALID] Result: {max_sessions} valid sessions")
-        return max_sessions
+        count = self._count_day_sessions
+        return max(
+            (count(student.get('attendance', {}).get(date)) for student in class_data.get('students', [])),
+            default=0
+        )
     
     def start_qr_session(self, class_id: str, teacher_id: str, date: str, rotation_interval: int = 5) -> dict:
         """Start QR session for attendance"""
-        print(f"\n{'='*60}")
-        print(f"[QR_SESSION] Starting QR session for class {class_id}, date {date}")
+        logger.debug("[QR_SESSION] Starting QR session for class %s, date %s", class_id, date)
         
         class_data = self.get_class(class_id)
         if not class_data or class_data.get("teacher_id") != teacher_id:
@@ -684,7 +2308,7 @@ class DatabaseManager:
         
         existing_session = self.get_qr_session(class_id, date)
         
-        if existing_session and existing_session.get("status") == "active":
+        if existing_session and existing_session.get("status") == _STATUS_ACTIVE:
             raise ValueError("There is already an active QR session for this date. Please stop it first.")
         
         session_number = valid_session_count + 1
@@ -699,73 +2323,83 @@ class DatabaseManager:
             "current_code": self._generate_qr_code(),
             "code_generated_at": datetime.utcnow().isoformat(),
             "scanned_students": [],
-            "status": "active"
+            "status": _STATUS_ACTIVE
         }
         
         self.create_qr_session(class_id, date, qr_session_data)
-        print(f"[QR_SESSION] Session #{session_number} started")
-        print(f"{'='*60}\n")
+        logger.debug("[QR_SESSION] Session #%d started", session_number)
         
         return qr_session_data
     
     def get_active_qr_session(self, class_id: str, date: str) -> Optional[dict]:
-        """Get active QR session with auto-rotation"""
-        session_data = self.get_qr_session(class_id, date)
-        
-        if not session_data or session_data.get("status") != "active":
-            return None
-        
-        # Auto-rotate code
-        code_time = datetime.fromisoformat(session_data["code_generated_at"])
-        elapsed = (datetime.utcnow() - code_time).total_seconds()
-        
-        if elapsed >= session_data["rotation_interval"]:
-            session_data["current_code"] = self._generate_qr_code()
-            session_data["code_generated_at"] = datetime.utcnow().isoformat()
-            self.update_qr_session(class_id, date, session_data)
-            print(f"[QR] Auto-rotated code for {class_id} on {date}")
-        
-        return session_data
+        """Get active QR session with auto-rotation (rotations are persisted in the background)"""
+        key = (class_id, date)
+        with self._qr_session_lock(class_id, date):
+            session_data = self._load_live_qr_session(class_id, date)
+            if session_data is None:
+                return None
+            
+            # Auto-rotate code
+            code_time = datetime.fromisoformat(session_data["code_generated_at"])
+            elapsed = (datetime.utcnow() - code_time).total_seconds()
+            
+            if elapsed >= session_data["rotation_interval"]:
+                session_data["current_code"] = self._generate_qr_code()
+                session_data["code_generated_at"] = datetime.utcnow().isoformat()
+                with self._qr_lock:
+                    self._dirty_qr.add(key)
+                self._enqueue_write("qr_session", key)
+                logger.debug("[QR] Auto-rotated code for %s on %s", class_id, date)
+            
+            return copy.deepcopy(session_data)
     
     def scan_qr_code(self, student_id: str, class_id: str, qr_code: str, date: str) -> Dict[str, Any]:
         """Handle QR code scan for attendance"""
-        print(f"\n{'='*60}")
-        print(f"[DB_QR_SCAN] Processing QR scan")
-        print(f"  Student ID: {student_id}, Class ID: {class_id}, Date: {date}")
-        print(f"{'='*60}")
+        now_iso = datetime.utcnow().isoformat()
         
         # Load QR session
         session_data = self.get_qr_session(class_id, date)
         
-        if not session_data or session_data.get("status") != "active":
+        if not session_data or session_data.get("status") != _STATUS_ACTIVE:
             raise ValueError("No active QR session")
         
-        # Validate QR code
-        try:
-            qr_data = json.loads(qr_code)
-            qr_code_value = qr_data.get("code")
-        except:
-            qr_code_value = qr_code
+        # Validate QR code (either the bare code or a {"code": ...} payload)
+        qr_code_value = qr_code
+        if qr_code[:1] == '{':
+            try:
+                qr_code_value = json.loads(qr_code)["code"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                pass
         
         if session_data.get("current_code") != qr_code_value:
             raise ValueError("Invalid or expired QR code")
         
         qr_session_number = session_data.get("session_number", 1)
+        result = {
+            "success": True,
+            "message": f"Attendance marked as Present (Session #{qr_session_number})",
+            "scan_count": qr_session_number,
+            "session_number": qr_session_number,
+            "date": date,
+        }
         
         # Find enrollment
-        all_enrollments = self.get_enrollments(class_id)
-        
-        enrollment = None
-        for e in all_enrollments:
-            if e.get("student_id") == student_id and e.get("status") == "active":
-                enrollment = e
-                break
+        enrollment = self._get_enrollment_index(class_id).get(student_id)
         
         if not enrollment:
             raise ValueError("Student not actively enrolled in this class")
         
         student_record_id = enrollment.get("student_record_id")
         
+        # A repeat scan within the same live session was already recorded - skip the class read and writes
+        with self._qr_lock:
+            scanned_set = self._qr_scanned.get((class_id, date))
+            already_scanned = scanned_set is not None and student_record_id in scanned_set
+        if already_scanned:
+            logger.debug("qr_scan repeat class=%s student=%s date=%s session=%s",
+                         class_id, student_id, date, qr_session_number)
+            return result
+        
         # Get class data
         class_data = self.get_class(class_id)
         if not class_data:
@@ -774,170 +2408,112 @@ class DatabaseManager:
         teacher_id = class_data.get("teacher_id")
         
         # Find student record in class
-        students = class_data.get('students', [])
-        student_record = None
-        for s in students:
-            if s.get('id') == student_record_id:
-                student_record = s
-                break
+        student_record = next(
+            (s for s in class_data.get('students', []) if s.get('id') == student_record_id), None
+        )
         
         if not student_record:
             raise ValueError("Student record not found")
         
-        # Initialize attendance
-        if 'attendance' not in student_record:
-            student_record['attendance'] = {}
-        
-        current_value = student_record['attendance'].get(date)
-        
-        # Update attendance based on session number
-        if qr_session_number == 1:
-            student_record['attendance'][date] = 'P'
-            print(f"[DB_QR_SCAN] Session 1: Marked 'P'")
-        else:
-            # Create or update sessions array
-            if isinstance(current_value, str) or current_value is None:
-                sessions = []
-                for i in range(1, qr_session_number + 1):
-                    sessions.append({
-                        "id": f"session_{i}",
-                        "name": f"QR Session {i}",
-                        "status": current_value if (i == 1 and isinstance(current_value, str)) else ("P" if i == qr_session_number else "A")
-                    })
-                student_record['attendance'][date] = {
-                    "sessions": sessions,
-                    "updated_at": datetime.utcnow().isoformat()
-                }
-            elif isinstance(current_value, dict) and 'sessions' in current_value:
-                sessions = current_value.get('sessions', [])
-                existing_ids = {s.get('id') for s in sessions}
-                
-                for i in range(1, qr_session_number + 1):
-                    session_id = f"session_{i}"
-                    if session_id not in existing_ids:
-                        sessions.insert(i - 1, {
-                            "id": session_id,
-                            "name": f"QR Session {i}",
-                            "status": "P" if i == qr_session_number else "A"
-                        })
-                    elif i == qr_session_number:
-                        for session in sessions:
-                            if session.get('id') == session_id:
-                                session['status'] = 'P'
-                                break
-                
-                student_record['attendance'][date] = {
-                    "sessions": sessions,
-                    "updated_at": datetime.utcnow().isoformat()
-                }
-        
-        # Save class data
-        self.update_class(class_id, class_data)
-        
-        # Record scan in QR session
-        scanned = session_data.get("scanned_students", [])
-        if student_record_id not in scanned:
-            scanned.append(student_record_id)
-        session_data["scanned_students"] = scanned
-        session_data["last_scan_at"] = datetime.utcnow().isoformat()
-        self.update_qr_session(class_id, date, session_data)
-        
-        print(f"[DB_QR_SCAN] SUCCESS - Session #{qr_session_number}")
-        
-        return {
-            "success": True,
-            "message": f"Attendance marked as Present (Session #{qr_session_number})",
-            "scan_count": qr_session_number,
-            "session_number": qr_session_number,
-            "date": date,
-        }
+        current_value = student_record.get('attendance', {}).get(date)
+        
+        # Mark for this session; the backend applies it to the class as stored, not this copy
+        new_value = self._apply_session_mark(current_value, qr_session_number, _MARK_P, now_iso)
+        mark_op = ("attendance", (class_id,), [(student_record_id, date, new_value)])
+        
+        # Record scan in QR session, starting from the live copy so concurrent scans are not lost.
+        # The mark is written even when this (cached) class already shows it, and the student only
+        # joins the scanned set once the mark and the session were both saved
+        with self._qr_session_lock(class_id, date):
+            live = self._load_live_qr_session(class_id, date)
+            if live is None:
+                raise ValueError("No active QR session")
+            with self._qr_lock:
+                scanned_set = self._qr_scanned[(class_id, date)]
+                already_scanned = student_record_id in scanned_set
+            if already_scanned:
+                return result
+            session_data = copy.deepcopy(live)
+            session_data.setdefault("scanned_students", []).append(student_record_id)
+            session_data["last_scan_at"] = now_iso
+            self.batch_update([mark_op, ("qr_session", (class_id, date), session_data)])
+            with self._qr_lock:
+                scanned_set.add(student_record_id)
+        
+        logger.debug("qr_scan class=%s student=%s date=%s session=%s", class_id, student_id, date, qr_session_number)
+        
+        return result
     
     def stop_qr_session(self, class_id: str, teacher_id: str, date: str) -> Dict[str, Any]:
-        """Stop QR session and mark absent for non-scanned students"""
-        session_data = self.get_qr_session(class_id, date)
-        
-        if not session_data or session_data.get("status") != "active":
-            raise ValueError("No active session")
-        
-        if session_data.get("teacher_id") != teacher_id:
-            raise ValueError("Unauthorized")
-        
-        qr_session_number = session_data.get("session_number", 1)
-        scanned_ids = set(session_data.get("scanned_students", []))
-        
-        print(f"[QR_STOP] Stopping QR Session #{qr_session_number}")
-        
-        # Get active enrollments
-        all_enrollments = self.get_enrollments(class_id)
-        active_student_ids = {
-            e.get("student_record_id")
-            for e in all_enrollments
-            if e.get("status") == "active"
-        }
-        
-        # Get class data
-        class_data = self.get_class(class_id)
-        students = class_data.get('students', [])
-        
-        # Mark absent for non-scanned students
-        marked_absent = 0
-        for student in students:
-            student_record_id = student.get('id')
-            if student_record_id in active_student_ids and student_record_id not in scanned_ids:
-                if 'attendance' not in student:
-                    student['attendance'] = {}
-                
-                current_value = student['attendance'].get(date)
-                
+        """
+        Stop QR session and mark absent for non-scanned students
+        Scanned students whose present mark is missing from the stored class get it again
+        """
+        # Held throughout, so no scan of this session lands between reading and closing it
+        with self._qr_session_lock(class_id, date):
+            now_iso = datetime.utcnow().isoformat()
+            session_data = self.get_qr_session(class_id, date)
+            
+            if not session_data or session_data.get("status") != _STATUS_ACTIVE:
+                raise ValueError("No active session")
+            
+            if session_data.get("teacher_id") != teacher_id:
+                raise ValueError("Unauthorized")
+            
+            qr_session_number = session_data.get("session_number", 1)
+            scanned_ids = set(session_data.get("scanned_students", []))
+            
+            # Get active enrollments
+            active_student_ids = {
+                e.get("student_record_id")
+                for e in self._get_enrollment_index(class_id).values()
+            }
+            
+            # Get class data as stored, not cached - it is checked for the scanned students' marks too
+            class_data = self.backend.get_class(class_id) or {}
+            student_by_id = {s.get('id'): s for s in class_data.get('students', [])}
+            
+            # Mark absent for non-scanned students, collecting the changed marks
+            absent = [student_by_id[sid] for sid in active_student_ids - scanned_ids if sid in student_by_id]
+            marks: List[Tuple[Any, str, Any]] = []
+            apply_mark = self._apply_session_mark
+            add_mark = marks.append
+            # A scan is only recorded after its mark was written, but a concurrent write of the whole
+            # class (or older data) can still have dropped it; re-marking is a no-op when it is there
+            for sid in active_student_ids & scanned_ids:
+                student = student_by_id.get(sid)
+                if student is not None:
+                    current_value = student.get('attendance', {}).get(date)
+                    new_value = apply_mark(current_value, qr_session_number, _MARK_P, now_iso)
+                    if new_value != current_value:
+                        add_mark((sid, date, new_value))
+            for student in absent:
+                current_value = student.get('attendance', {}).get(date)
                 if qr_session_number == 1:
-                    student['attendance'][date] = 'A'
+                    # Session 1 stores the bare mark, so no per-student merging is needed
+                    new_value = _MARK_A
                 else:
-                    if isinstance(current_value, str) or current_value is None:
-                        sessions = []
-                        for i in range(1, qr_session_number + 1):
-                            sessions.append({
-                                "id": f"session_{i}",
-                                "name": f"QR Session {i}",
-                                "status": current_value if (i == 1 and isinstance(current_value, str)) else "A"
-                            })
-                        student['attendance'][date] = {
-                            "sessions": sessions,
-                            "updated_at": datetime.utcnow().isoformat()
-                        }
-                    elif isinstance(current_value, dict) and 'sessions' in current_value:
-                        sessions = current_value.get('sessions', [])
-                        existing_ids = {s.get('id') for s in sessions}
-                        
-                        for i in range(1, qr_session_number + 1):
-                            session_id = f"session_{i}"
-                            if session_id not in existing_ids:
-                                sessions.insert(i - 1, {
-                                    "id": session_id,
-                                    "name": f"QR Session {i}",
-                                    "status": "A"
-                                })
-                        
-                        student['attendance'][date] = {
-                            "sessions": sessions,
-                            "updated_at": datetime.utcnow().isoformat()
-                        }
-                
-                marked_absent += 1
-        
-        # Save class data
-        self.update_class(class_id, class_data)
-        
-        # Close QR session
-        session_data["status"] = "stopped"
-        session_data["stopped_at"] = datetime.utcnow().isoformat()
-        self.update_qr_session(class_id, date, session_data)
-        
-        print(f"[QR_STOP] Session {qr_session_number} stopped")
-        
-        return {
-            "success": True,
-            "scanned_count": len(scanned_ids),
-            "absent_count": marked_absent,
-            "date": date,
-            "session_number": qr_session_number
-        }
\ No newline at end of file
+                    new_value = apply_mark(current_value, qr_session_number, _MARK_A, now_iso)
+                # Only marks that actually changed are written back (e.g. a re-run stop writes nothing)
+                if new_value != current_value:
+                    add_mark((student.get('id'), date, new_value))
+            marked_absent = len(absent)
+            
+            # Save only the absent marks, together with closing the QR session
+            ops: List[Tuple[str, Tuple, Any]] = []
+            if marks:
+                ops.append(("attendance", (class_id,), marks))
+            session_data["status"] = "stopped"
+            session_data["stopped_at"] = now_iso
+            ops.append(("qr_session", (class_id, date), session_data))
+            self.batch_update(ops)
+            
+            logger.debug("qr_stop class=%s date=%s session=%s absent=%d", class_id, date, qr_session_number, marked_absent)
+            
+            return {
+                "success": True,
+                "scanned_count": len(scanned_ids),
+                "absent_count": marked_absent,
+                "date": date,
+                "session_number": qr_session_number
+            }
\ No newline at end of file
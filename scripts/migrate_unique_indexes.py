@@ -0,0 +1,75 @@
+"""
+Upgrade the enrollment / QR session indexes of an existing MongoDB database to unique ones.
+
+Older deployments created these indexes without `unique`, so their collections may hold
+duplicate (class_id, student_id) enrollments or (class_id, date) QR sessions. For each
+index this keeps the most recently updated document of every duplicate group, deletes the
+rest, drops the non-unique index and creates the unique one. Without --apply it only
+reports what it would delete.
+
+    python scripts/migrate_unique_indexes.py --mongo-uri mongodb://... [--database lernova_db] [--apply]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import MongoDBBackend  # noqa: E402
+
+
+def duplicate_groups(collection, fields):
+    """(key, ids to delete) for every group of documents sharing the same values of fields"""
+    groups = collection.aggregate([
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        {"$group": {
+            "_id": {field: f"${field}" for field in fields},
+            "keep": {"$first": "$_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    for group in groups:
+        yield group["_id"], [doc_id for doc_id in group["ids"] if doc_id != group["keep"]]
+
+
+def migrate(collection, keys, apply: bool) -> None:
+    fields = [field for field, _ in keys]
+    removed = 0
+    for key, extra in duplicate_groups(collection, fields):
+        print(f"{collection.name} {key}: {len(extra)} duplicate(s)")
+        if apply:
+            collection.delete_many({"_id": {"$in": extra}})
+        removed += len(extra)
+    if not apply:
+        print(f"{collection.name}: would delete {removed} document(s)")
+        return
+    for name, info in list(collection.index_information().items()):
+        if [field for field, _ in info.get("key", [])] == fields and not info.get("unique"):
+            collection.drop_index(name)
+    collection.create_index(keys, unique=True)
+    print(f"{collection.name}: deleted {removed} document(s), unique index on {fields} in place")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI"))
+    parser.add_argument("--database", default="lernova_db")
+    parser.add_argument("--apply", action="store_true", help="delete duplicates and replace the indexes")
+    args = parser.parse_args()
+    if not args.mongo_uri:
+        parser.error("--mongo-uri (or MONGO_URI) is required")
+
+    from pymongo import MongoClient
+
+    client = MongoClient(args.mongo_uri)
+    db = client[args.database]
+    for collection_name, keys in MongoDBBackend.UNIQUE_COMPOUND_INDEXES:
+        migrate(db[collection_name], keys, args.apply)
+    client.close()
+
+
+if __name__ == "__main__":
+    main()